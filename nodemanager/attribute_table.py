@@ -1,5 +1,6 @@
 import logging
 import sys
+import threading
 try:
     from enum import Enum
 except ImportError:
@@ -7,6 +8,8 @@ except ImportError:
 
 from PySide2 import QtWidgets, QtCore, QtGui
 
+from . import filter_expression
+from . import manager
 from . import utils
 
 
@@ -15,6 +18,17 @@ if sys.version_info[0] >= 3:
     unicode = str
 
 
+# marks values that have not been loaded yet
+_empty = object()
+
+
+def mixed_sort_key(key):
+    # numbers keep their numeric order, other values are compared as text
+    if isinstance(key, (int, float)) and not isinstance(key, bool):
+        return (0, key, '')
+    return (1, 0, str(key))
+
+
 class AttributeTableView(QtWidgets.QTableView):
     def __init__(self, parent=None):
         super(AttributeTableView, self).__init__(parent)
@@ -36,6 +50,8 @@ class AttributeTableView(QtWidgets.QTableView):
         header = self.horizontalHeader()
         header.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
 
+        self.verticalScrollBar().valueChanged.connect(self.visible_rows_changed)
+
     @property
     def _model(self):
         model = super(AttributeTableView, self).model()
@@ -54,6 +70,22 @@ class AttributeTableView(QtWidgets.QTableView):
 
         return attribute_items
 
+    def visible_rows_changed(self):
+        # cancel deferred loading of rows that were scrolled out of view
+        model = self.model()
+        if not model or not self._model:
+            return
+
+        first = self.rowAt(0)
+        if first < 0:
+            return
+        last = self.rowAt(self.viewport().height() - 1)
+        if last < 0:
+            last = model.rowCount() - 1
+
+        rows = [model.mapToSource(model.index(row, 0)).row() for row in range(first, last + 1)]
+        self._model.loader.retain(rows)
+
     def update_requested(self):
         header_state = self.header_state
         if header_state:
@@ -99,7 +131,7 @@ class AttributeTableView(QtWidgets.QTableView):
 
         model_index = self.model().mapToSource(index)
 
-        if not self._model.itemFromIndex(model_index).isEditable():
+        if not self._model.flags(model_index) & QtCore.Qt.ItemIsEditable:
             return
 
         menu = QtWidgets.QMenu(self)
@@ -113,7 +145,7 @@ class AttributeTableView(QtWidgets.QTableView):
         header = self.horizontalHeader()
         headers = {}
         for i in range(header.count()):
-            attribute = self._model.horizontalHeaderItem(i).data()
+            attribute = self._model.headerData(i, QtCore.Qt.Horizontal, QtCore.Qt.UserRole + 1)
             visibility = not header.isSectionHidden(i)
             width = header.sectionSize(i)
             visual_index = header.visualIndex(i)
@@ -135,7 +167,7 @@ class AttributeTableView(QtWidgets.QTableView):
 
         header = self.horizontalHeader()
         for i in range(header.count()):
-            attribute = self._model.horizontalHeaderItem(i).data()
+            attribute = self._model.headerData(i, QtCore.Qt.Horizontal, QtCore.Qt.UserRole + 1)
             values = headers.get(attribute)
             if values:
                 visibility = values.get('visibility', True)
@@ -153,9 +185,9 @@ class AttributeTableView(QtWidgets.QTableView):
             header.removeAction(action)
 
         for i in range(header.count()):
-            item = self._model.horizontalHeaderItem(i)
+            text = self._model.headerData(i, QtCore.Qt.Horizontal, QtCore.Qt.DisplayRole)
 
-            action = QtWidgets.QAction(item.text(), self)
+            action = QtWidgets.QAction(text, self)
             action.setCheckable(True)
             action.setChecked(not header.isSectionHidden(i))
             action.triggered.connect(self.update_header)
@@ -178,98 +210,453 @@ class AttributeTableView(QtWidgets.QTableView):
         return delegate
 
 
-class AttributeItemModel(QtGui.QStandardItemModel):
+class AttributeItemModel(QtCore.QAbstractTableModel):
     update_requested = QtCore.Signal()
     updated = QtCore.Signal()
+    rows_invalidated = QtCore.Signal(list)
 
     def __init__(self, parent=None):
         super(AttributeItemModel, self).__init__(parent)
         self.attributes = []
+        self.attribute_items = []
+        # cached values per column, allocated on first access
+        self.columns = []
+        # normalized sort keys per column
+        self.sort_keys = {}
+        self.rows = {}
+
+        self.loader = AttributeLoader(self)
+        self.loader.loaded.connect(self.set_loaded_data)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.attribute_items)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.attributes)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and 0 <= section < len(self.attributes):
+            if role == QtCore.Qt.DisplayRole:
+                return utils.title(self.attributes[section])
+            elif role == QtCore.Qt.UserRole + 1:
+                return self.attributes[section]
+        return super(AttributeItemModel, self).headerData(section, orientation, role)
+
+    def flags(self, index):
+        flags = super(AttributeItemModel, self).flags(index)
+        if index.isValid():
+            attribute_item = self.attribute_items[index.row()]
+            if self.attributes[index.column()] not in attribute_item.locked_attributes:
+                flags |= QtCore.Qt.ItemIsEditable
+        return flags
 
     def data(self, index, role=QtCore.Qt.DisplayRole):
-        # override to enable deferred loading of items
-        data = super(AttributeItemModel, self).data(index, role)
-        if data is None and role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
-            attribute_item = self.attribute_item_from_index(index)
-            try:
-                attribute = self.attribute_from_index(index)
-                data = getattr(attribute_item, attribute)
-            except AttributeError:
-                data = '---'
-            super(AttributeItemModel, self).setData(index, data, role)
+        # values are loaded on demand and cached per column
+        if not index.isValid():
+            return None
+
+        row = index.row()
+        column = index.column()
+
+        if role == QtCore.Qt.UserRole + 1:
+            return self.attribute_items[row]
+        elif role not in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return None
+
+        values = self.column_values(column)
+        data = values[row]
+        if data is _empty:
+            attribute_item = self.attribute_items[row]
+            attribute = self.attributes[column]
+
+            # file system queries are resolved in a thread
+            if attribute in attribute_item.filesystem_attributes:
+                self.loader.request(row, column, attribute_item, attribute)
+                return self.loader.placeholder
+
+            data = self.load_value(row, column)
         return data
 
-    def setData(self, index, value, role):
-        result = super(AttributeItemModel, self).setData(index, value, role)
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid() or role != QtCore.Qt.EditRole:
+            return False
+        return self.set_values([index], value)
+
+    def set_values(self, indexes, value):
+        # writes value to all indexes as one bulk write with a single update
+        edits = []
+        rows = set()
+        for index in indexes:
+            if not index.isValid():
+                continue
+            attribute_item = self.attribute_items[index.row()]
+            attribute = self.attributes[index.column()]
+            edits.append((attribute_item, attribute, value))
+            rows.add(index.row())
+        if not edits:
+            return False
 
-        if role == QtCore.Qt.EditRole:
-            attribute_item = self.attribute_item_from_index(index)
-            attribute = self.attribute_from_index(index)
-            try:
-                setattr(attribute_item, attribute, value)
-            except AttributeError:
-                return False
+        applied = manager.set_attributes(edits)
+
+        # other attributes such as the file status can depend on the edited one
+        self.invalidate_rows(sorted(rows))
+        return bool(applied)
+
+    def column_values(self, column):
+        values = self.columns[column]
+        if values is None:
+            values = [_empty] * len(self.attribute_items)
+            self.columns[column] = values
+        return values
+
+    def load_value(self, row, column):
+        attribute_item = self.attribute_items[row]
+        attribute = self.attributes[column]
+        try:
+            data = getattr(attribute_item, attribute)
+        except AttributeError:
+            data = '---'
+        self.column_values(column)[row] = data
+        return data
+
+    def cell_value(self, index):
+        return self.value_at(index.row(), index.column())
+
+    def value_at(self, row, column):
+        # resolve the value right away, even for file system attributes
+        data = self.column_values(column)[row]
+        if data is _empty:
+            self.loader.cancel_runnable((row, column))
+            data = self.load_value(row, column)
+        return data
+
+    def load_column(self, column):
+        values = self.column_values(column)
+        for row, value in enumerate(values):
+            if value is _empty:
+                self.value_at(row, column)
+        return values
+
+    def set_loaded_data(self, results):
+        rows = []
+        columns = []
+
+        for row, column, attribute_item, value in results:
+            if row >= len(self.attribute_items) or self.attribute_items[row] is not attribute_item:
+                continue
+            self.column_values(column)[row] = value
+            rows.append(row)
+            columns.append(column)
 
-        return True and result
+        # emit a single dataChanged for the whole batch
+        if rows:
+            top_left = self.index(min(rows), min(columns))
+            bottom_right = self.index(max(rows), max(columns))
+            self.dataChanged.emit(top_left, bottom_right)
 
     def attribute_item_from_index(self, index):
-        item = self.item(index.row(), 0)
-        if item:
-            return item.data()
+        if index.isValid() and index.row() < len(self.attribute_items):
+            return self.attribute_items[index.row()]
 
     def attribute_from_index(self, index):
-        header_item = self.horizontalHeaderItem(index.column())
-        if header_item:
-            return header_item.data()
+        if 0 <= index.column() < len(self.attributes):
+            return self.attributes[index.column()]
 
     def set_items(self, attribute_items):
         self.update_requested.emit()
-        self.clear()
-        self.set_headers(attribute_items)
-        for attribute_item in attribute_items:
-            items = []
-            for i, attribute in enumerate(attribute_item.attributes):
-                item = QtGui.QStandardItem()
-
-                if attribute in attribute_item.locked_attributes:
-                    item.setFlags(item.flags() & ~QtCore.Qt.ItemIsEditable)
+        self.loader.clear()
 
-                if i == 0:
-                    item.setData(attribute_item)
+        self.beginResetModel()
+        self.attribute_items = list(attribute_items)
+        self.rows = {id(attribute_item): row for row, attribute_item in enumerate(self.attribute_items)}
+        self.set_headers(self.attribute_items)
+        self.endResetModel()
 
-                items.append(item)
+        self.updated.emit()
 
-            if items:
-                self.appendRow(items)
+    def merge_items(self, attribute_items, keep_values=True):
+        # only insert and remove the rows that changed, kept rows keep their
+        # node and cached values unless keep_values is False.
+        attributes = list(attribute_items[0].attributes) if attribute_items else []
+        if not self.attribute_items or attributes != self.attributes:
+            self.set_items(attribute_items)
+            return
 
-        self.updated.emit()
+        keys = set(attribute_item.node for attribute_item in attribute_items)
+        removed_rows = [
+            row for row, attribute_item in enumerate(self.attribute_items)
+            if attribute_item.node not in keys]
+
+        existing_keys = set(attribute_item.node for attribute_item in self.attribute_items)
+        added_items = [
+            attribute_item for attribute_item in attribute_items
+            if attribute_item.node not in existing_keys]
+
+        if removed_rows or added_items:
+            # pending requests are requested again on repaint
+            self.loader.clear()
+
+        # remove contiguous ranges from the bottom up
+        ranges = []
+        for row in removed_rows:
+            if ranges and ranges[-1][1] == row - 1:
+                ranges[-1][1] = row
+            else:
+                ranges.append([row, row])
+        for first, last in reversed(ranges):
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            del self.attribute_items[first:last + 1]
+            for values in self.columns + list(self.sort_keys.values()):
+                if values is not None:
+                    del values[first:last + 1]
+            self.endRemoveRows()
+
+        if added_items and keep_values:
+            # the load covers all nodes, added rows only read their own nodes
+            manager.attach(added_items)
+
+        if added_items:
+            first = len(self.attribute_items)
+            last = first + len(added_items) - 1
+            self.beginInsertRows(QtCore.QModelIndex(), first, last)
+            self.attribute_items.extend(added_items)
+            for values in self.columns + list(self.sort_keys.values()):
+                if values is not None:
+                    values.extend([_empty] * len(added_items))
+            self.endInsertRows()
+
+        if not keep_values:
+            # take over the new nodes so that values are read from the new load
+            items = {attribute_item.node: attribute_item for attribute_item in attribute_items}
+            self.attribute_items = [items[attribute_item.node] for attribute_item in self.attribute_items]
+
+        self.rows = {id(attribute_item): row for row, attribute_item in enumerate(self.attribute_items)}
+
+        if not keep_values:
+            self.update()
 
     def update(self):
-        for row in range(self.rowCount()):
-            self.update_index(self.index(row, 0))
+        self.invalidate_rows(range(self.rowCount()))
 
     def update_items(self, attribute_items):
-        for row in range(self.rowCount()):
-            attribute_item = self.item(row, 0).data()
-            if attribute_item in attribute_items:
-                self.update_index(self.index(row, 0))
-                attribute_items.remove(attribute_item)
-                if not attribute_items:
-                    break
+        rows = [self.rows[id(item)] for item in attribute_items if id(item) in self.rows]
+        self.invalidate_rows(rows)
 
     def update_index(self, index):
-        for column in range(self.columnCount()):
-            item = self.item(index.row(), column)
-            item.setData(None, QtCore.Qt.DisplayRole)
+        self.invalidate_rows([index.row()])
+
+    def invalidate_rows(self, rows):
+        rows = list(rows)
+        if not rows:
+            return
+
+        self.loader.cancel(rows)
+        for row in rows:
+            self.attribute_items[row].invalidate()
+        for values in self.columns + list(self.sort_keys.values()):
+            if values is not None:
+                for row in rows:
+                    values[row] = _empty
+        self.rows_invalidated.emit(rows)
+
+        top_left = self.index(min(rows), 0)
+        bottom_right = self.index(max(rows), self.columnCount() - 1)
+        self.dataChanged.emit(top_left, bottom_right)
 
     def set_headers(self, attribute_items):
         if attribute_items:
-            self.attributes = attribute_items[0].attributes
-            for i, attribute in enumerate(self.attributes):
-                item = QtGui.QStandardItem()
-                item.setText(utils.title(attribute))
-                item.setData(attribute)
-                self.setHorizontalHeaderItem(i, item)
+            self.attributes = list(attribute_items[0].attributes)
+        else:
+            self.attributes = []
+        self.columns = [None] * len(self.attributes)
+        self.sort_keys = {}
+
+    def is_filesystem_column(self, column):
+        if not self.attribute_items or not 0 <= column < len(self.attributes):
+            return False
+        return self.attributes[column] in self.attribute_items[0].filesystem_attributes
+
+    def key_at(self, row, column, normalize=None):
+        # normalized value of a single cell, shared with sorting
+        keys = self.sort_keys.get(column)
+        if keys is None:
+            keys = [_empty] * len(self.attribute_items)
+            self.sort_keys[column] = keys
+
+        key = keys[row]
+        if key is _empty:
+            value = self.value_at(row, column)
+            key = normalize(value) if normalize else value
+            keys[row] = key
+        return key
+
+    def column_sort_keys(self, column, normalize=None):
+        # values are fetched once per row and kept until the row is invalidated
+        keys = self.sort_keys.get(column)
+        if keys is None:
+            keys = [_empty] * len(self.attribute_items)
+            self.sort_keys[column] = keys
+
+        for row, key in enumerate(keys):
+            if key is _empty:
+                value = self.value_at(row, column)
+                keys[row] = normalize(value) if normalize else value
+        return keys
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder, normalize=None):
+        if not 0 <= column < len(self.attributes):
+            return
+
+        keys = self.column_sort_keys(column, normalize)
+        reverse = order == QtCore.Qt.DescendingOrder
+        try:
+            order_rows = sorted(range(len(keys)), key=keys.__getitem__, reverse=reverse)
+        except TypeError:
+            # mixed types, for example missing attributes
+            order_rows = sorted(
+                range(len(keys)),
+                key=lambda row: mixed_sort_key(keys[row]),
+                reverse=reverse)
+
+        self.layoutAboutToBeChanged.emit()
+
+        # rows will move, pending requests are requested again on repaint
+        self.loader.clear()
+
+        self.attribute_items = [self.attribute_items[row] for row in order_rows]
+        self.rows = {id(attribute_item): row for row, attribute_item in enumerate(self.attribute_items)}
+        for i, values in enumerate(self.columns):
+            if values is not None:
+                self.columns[i] = [values[row] for row in order_rows]
+        for i, values in self.sort_keys.items():
+            self.sort_keys[i] = [values[row] for row in order_rows]
+
+        positions = [0] * len(order_rows)
+        for new_row, old_row in enumerate(order_rows):
+            positions[old_row] = new_row
+        old_indexes = self.persistentIndexList()
+        new_indexes = [self.index(positions[index.row()], index.column()) for index in old_indexes]
+        self.changePersistentIndexList(old_indexes, new_indexes)
+
+        self.layoutChanged.emit()
+
+
+class AttributeLoader(QtCore.QObject):
+    """Resolves file system attributes of nodes on a thread pool.
+
+    Results are collected and handed back to the model in batches. Requests
+    can be cancelled for rows that are no longer visible.
+    """
+
+    loaded = QtCore.Signal(list)
+
+    placeholder = '...'
+
+    def __init__(self, parent=None, threads=4, interval=100):
+        super(AttributeLoader, self).__init__(parent)
+
+        self.threadpool = QtCore.QThreadPool(self)
+        self.threadpool.setMaxThreadCount(threads)
+
+        # {(row, column): runnable}
+        self.runnables = {}
+        self.results = []
+        self.lock = threading.Lock()
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+
+    def request(self, row, column, attribute_item, attribute):
+        key = (row, column)
+        if key in self.runnables:
+            return
+
+        # read the dcc attributes on the main thread, the file system in a thread
+        file_info = attribute_item.file_info()
+        runnable = AttributeLoaderRunnable(self, key, attribute_item, file_info, attribute)
+        self.runnables[key] = runnable
+        self.threadpool.start(runnable)
+
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def cancel(self, rows):
+        rows = set(rows)
+        for key in list(self.runnables):
+            if key[0] in rows:
+                self.cancel_runnable(key)
+
+    def retain(self, rows):
+        # cancel all requests for rows that are not in rows
+        rows = set(rows)
+        for key in list(self.runnables):
+            if key[0] not in rows:
+                self.cancel_runnable(key)
+
+    def cancel_runnable(self, key):
+        runnable = self.runnables.pop(key, None)
+        if runnable is None:
+            return
+        runnable.cancelled = True
+        if hasattr(self.threadpool, 'tryTake'):
+            self.threadpool.tryTake(runnable)
+
+    def clear(self):
+        for key in list(self.runnables):
+            self.cancel_runnable(key)
+        with self.lock:
+            self.results = []
+
+    def add_result(self, runnable, value):
+        # called from the thread pool
+        with self.lock:
+            self.results.append((runnable, value))
+
+    def flush(self):
+        with self.lock:
+            results = self.results
+            self.results = []
+
+        data = []
+        for runnable, value in results:
+            if runnable.cancelled or self.runnables.get(runnable.key) is not runnable:
+                continue
+            del self.runnables[runnable.key]
+            row, column = runnable.key
+            data.append((row, column, runnable.attribute_item, value))
+
+        if not self.runnables:
+            self.timer.stop()
+
+        if data:
+            self.loaded.emit(data)
+
+
+class AttributeLoaderRunnable(QtCore.QRunnable):
+    def __init__(self, loader, key, attribute_item, file_info, attribute):
+        super(AttributeLoaderRunnable, self).__init__()
+        self.loader = loader
+        self.key = key
+        self.attribute_item = attribute_item
+        self.file_info = file_info
+        self.attribute = attribute
+        self.cancelled = False
+        self.setAutoDelete(False)
+
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            value = getattr(self.file_info, self.attribute)
+        except Exception as e:
+            logging.debug(e)
+            value = '---'
+        self.loader.add_result(self, value)
 
 
 class AttributeSortModel(QtCore.QSortFilterProxyModel):
@@ -278,6 +665,14 @@ class AttributeSortModel(QtCore.QSortFilterProxyModel):
     def __init__(self, parent=None):
         super(AttributeSortModel, self).__init__(parent)
         self.setFilterRegExp('')
+        self.predicates = []
+        self.expression = None
+        self.expression_text = ''
+        self.table = None
+        # cached filter result per source row, None if not evaluated
+        self.accepted = None
+        self.sort_column = -1
+        self.sort_order = QtCore.Qt.AscendingOrder
 
     def value(self, value):
         # py 2.7
@@ -288,50 +683,209 @@ class AttributeSortModel(QtCore.QSortFilterProxyModel):
             return str(value)
         elif isinstance(value, Enum):
             return value.value
+        elif isinstance(value, utils.FileSize):
+            return int(value)
         return value
 
-    def lessThan(self, left, right):
-        # load requested item / override data
-        return False
-        left_value = self.value(self.sourceModel().data(left))
-        right_value = self.value(self.sourceModel().data(right))
-        try:
-            return left_value < right_value
-        except TypeError:
-            return False
+    def setSourceModel(self, model):
+        super(AttributeSortModel, self).setSourceModel(model)
+        self.table = ExpressionTable(model)
+        model.modelAboutToBeReset.connect(self.source_about_to_reset)
+        model.modelReset.connect(self.source_reset)
+        model.layoutAboutToBeChanged.connect(self.layout_about_to_change)
+        model.rows_invalidated.connect(self.rows_invalidated)
+        model.rowsInserted.connect(self.source_rows_inserted)
+        model.rowsRemoved.connect(self.source_rows_removed)
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        # sorting is done on the source model from precomputed sort keys,
+        # this avoids calling lessThan and data for every comparison.
+        self.sort_column = column
+        self.sort_order = order
+        model = self.sourceModel()
+        if model is not None and column >= 0:
+            model.sort(column, order, self.value)
+
+    def source_about_to_reset(self):
+        self.table.invalidate()
+        if self.accepted is not None:
+            self.accepted = []
+
+    def source_reset(self):
+        # the attributes can change with a reset, resolve the columns again
+        self.predicates = self.compile_filters(self.filters)
+        self.expression = self.parse_expression(self.expression_text)
+        self.accepted = self.accepted_rows()
+        self.invalidateFilter()
+
+        # file system columns are resolved by the loader, sorting them here
+        # would query every file on the gui thread
+        model = self.sourceModel()
+        if self.sort_column >= 0 and not model.is_filesystem_column(self.sort_column):
+            self.sort(self.sort_column, self.sort_order)
 
     def filterAcceptsRow(self, source_row, source_parent):
+        accepted = self.accepted
+        if accepted is None:
+            return True
+
+        if source_row < len(accepted):
+            result = accepted[source_row]
+            if result is not None:
+                return result
+
+        result = self.filter_row(source_row)
+        if source_row < len(accepted):
+            accepted[source_row] = result
+        return result
+
+    def filter_row(self, source_row):
+        key_at = self.sourceModel().key_at
+        for column, predicate in self.predicates:
+            if not predicate(key_at(source_row, column, self.value)):
+                return False
+        if self.expression is not None:
+            return self.expression.test(self.table, source_row)
+        return True
+
+    def accepted_rows(self):
+        # evaluate all rows column by column in one pass over the cached values
+        if not self.predicates and self.expression is None:
+            return None
+
         model = self.sourceModel()
+        accepted = [True] * model.rowCount()
+        for column, predicate in self.predicates:
+            keys = model.column_sort_keys(column, self.value)
+            accepted = [result and predicate(key) for result, key in zip(accepted, keys)]
+
+        if self.expression is not None:
+            candidates = None
+            if self.predicates:
+                candidates = set(row for row, result in enumerate(accepted) if result)
+            rows = self.expression.rows(self.table, candidates)
+            accepted = [row in rows for row in range(len(accepted))]
+        return accepted
+
+    def rows_invalidated(self, rows):
+        self.table.invalidate()
+        accepted = self.accepted
+        if accepted is not None:
+            for row in rows:
+                if row < len(accepted):
+                    accepted[row] = None
+
+    def source_rows_inserted(self, parent, first, last):
+        self.table.invalidate()
+        if self.accepted is not None:
+            self.accepted[first:first] = [None] * (last - first + 1)
+
+    def source_rows_removed(self, parent, first, last):
+        self.table.invalidate()
+        if self.accepted is not None:
+            del self.accepted[first:last + 1]
+
+    def layout_about_to_change(self):
+        # rows are about to move, evaluate them again when they are requested
+        self.table.invalidate()
+        if self.accepted is not None:
+            self.accepted = [None] * self.sourceModel().rowCount()
+
+    def compile_filters(self, filters):
+        # resolve columns and filter values once, rows are tested against
+        # the normalized values cached on the source model.
+        model = self.sourceModel()
+        predicates = []
 
-        for attribute, filter_value in self.filters.items():
+        for attribute, filter_value in filters.items():
             try:
                 column = model.attributes.index(attribute)
-            except IndexError:
+            except ValueError:
                 continue
-            index = model.index(source_row, column, source_parent)
 
-            item_value = self.value(model.data(index))
             filter_value = self.value(filter_value)
 
-            # support for filtering string lists
-            if isinstance(item_value, list):
-                item_value = ''.join(item_value)
-
             # py 2.7
             if isinstance(filter_value, str) or isinstance(filter_value, unicode):
-                # todo: add support for expressions?
-                if filter_value not in item_value:
-                    break
-            elif filter_value != item_value:
-                break
-        else:
-            return True
+                predicate = self.contains_predicate(filter_value)
+            else:
+                predicate = self.equals_predicate(filter_value)
+            predicates.append((column, predicate))
+        return predicates
 
-        return False
+    def contains_predicate(self, filter_value):
+        value = self.value
+
+        def predicate(item_value):
+            # support for filtering string lists
+            if isinstance(item_value, list):
+                item_value = value(''.join(item_value))
+            try:
+                return filter_value in item_value
+            except TypeError:
+                return False
+        return predicate
+
+    @staticmethod
+    def equals_predicate(filter_value):
+        def predicate(item_value):
+            return item_value == filter_value
+        return predicate
 
     def update_filters(self, filters):
         self.filters = filters
-        self.invalidate()
+        self.predicates = self.compile_filters(filters)
+        self.accepted = self.accepted_rows()
+        self.invalidateFilter()
+
+    def update_expression(self, text):
+        self.expression_text = text
+        self.expression = self.parse_expression(text)
+        self.accepted = self.accepted_rows()
+        self.invalidateFilter()
+
+    def parse_expression(self, text):
+        if not text:
+            return None
+        try:
+            return filter_expression.parse(text, self.sourceModel().attributes)
+        except filter_expression.ExpressionError as e:
+            logging.debug(e)
+
+
+class ExpressionTable(object):
+    """Gives filter expressions access to the cached values of the model.
+
+    Column indexes are built on first use and dropped whenever rows of the
+    model are invalidated or moved.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.indexes = {}
+
+    def row_count(self):
+        return self.model.rowCount()
+
+    def values(self, attribute):
+        return self.model.load_column(self.model.attributes.index(attribute))
+
+    def value(self, attribute, row):
+        return self.model.value_at(row, self.model.attributes.index(attribute))
+
+    def index(self, attribute):
+        index = self.indexes.get(attribute)
+        if index is None:
+            index = filter_expression.ColumnIndex(self.values(attribute))
+            self.indexes[attribute] = index
+        return index
+
+    def cached_index(self, attribute):
+        # returns None if the index has not been built yet
+        return self.indexes.get(attribute)
+
+    def invalidate(self):
+        self.indexes = {}
 
 
 class Delegate(QtWidgets.QStyledItemDelegate):
@@ -339,16 +893,31 @@ class Delegate(QtWidgets.QStyledItemDelegate):
         # Set ModelData on all selected rows
 
         # Sometimes the right click happens on not selected row
-        indexes = [index]
+        rows = set([index.row()])
         if self.parent() and self.parent().selectionModel():
-            indexes.extend(self.parent().selectionModel().selectedRows(index.column()))
-        indexes = list(set(indexes))
+            # the view selects whole rows, ranges avoid testing every cell
+            for selection_range in self.parent().selectionModel().selection():
+                rows.update(range(selection_range.top(), selection_range.bottom() + 1))
+        indexes = [model.index(row, index.column()) for row in sorted(rows)]
+
+        if value is None:
+            # read the value of the editor once for all rows
+            name = editor.metaObject().userProperty().name()
+            if not name:
+                for item_index in indexes:
+                    super(Delegate, self).setModelData(editor, model, item_index)
+                return
+            value = editor.property(name)
+
+        while isinstance(model, QtCore.QAbstractProxyModel):
+            indexes = [model.mapToSource(item_index) for item_index in indexes]
+            model = model.sourceModel()
 
-        for item_index in indexes:
-            if value is not None:
+        if hasattr(model, 'set_values'):
+            model.set_values(indexes, value)
+        else:
+            for item_index in indexes:
                 model.setData(item_index, value, QtCore.Qt.EditRole)
-            else:
-                super(Delegate, self).setModelData(editor, model, item_index)
 
     def updateEditorGeometry(self, editor, option, index):
         editor.setGeometry(option.rect)
@@ -394,7 +963,9 @@ class EnumDelegate(Delegate):
         self.enum = enum
 
     def displayText(self, value, locale):
-        return value.name
+        if isinstance(value, Enum):
+            return value.name
+        return super(EnumDelegate, self).displayText(value, locale)
 
     def createEditor(self, parent, option, index):
         editor = QtWidgets.QComboBox(parent)
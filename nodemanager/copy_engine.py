@@ -0,0 +1,421 @@
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+from PySide2 import QtCore
+
+
+BUFFER_SIZE = 1 << 20
+# bytes per sendfile / copy_file_range call, small enough for smooth progress
+CHUNK_SIZE = 8 << 20
+
+# errors of the kernel copy functions on unsupported files, devices or systems
+_fallback_errors = set(
+    getattr(errno, name) for name in ('EXDEV', 'ENOSYS', 'EINVAL', 'ENOTSUP', 'EOPNOTSUPP', 'ENOTSOCK')
+    if hasattr(errno, name))
+
+
+class CopyCancelled(Exception):
+    pass
+
+
+def copy_file(source, target, callback=None, cancelled=None, checksum=False):
+    """Copies the content and permission bits of source to target.
+
+    Uses copy_file_range or sendfile to copy in the kernel where available,
+    otherwise a large buffer. callback is called with the number of bytes
+    written, cancelled is called between chunks and aborts the copy if it
+    returns True. The file is written to a uniquely named temporary file
+    first, so target is never left incomplete, even if other processes copy
+    to the same target. With checksum the sha1 of the written file is
+    returned.
+    """
+
+    dirpath, filename = os.path.split(os.path.abspath(target))
+    digest = None
+    with open(source, 'rb') as fsrc:
+        fd, tmp_path = tempfile.mkstemp(prefix='{}.'.format(filename), suffix='.tmp', dir=dirpath)
+        try:
+            with os.fdopen(fd, 'wb') as fdst:
+                if _copy_kernel(fsrc, fdst, callback, cancelled):
+                    sha1 = None
+                else:
+                    sha1 = hashlib.sha1() if checksum else None
+                    _copy_buffered(fsrc, fdst, callback, cancelled, sha1)
+            if checksum:
+                # kernel copies never pass the data through python, hash the
+                # written file instead
+                digest = sha1.hexdigest() if sha1 is not None else file_hash(tmp_path)
+            shutil.copymode(source, tmp_path)
+            replace(tmp_path, target)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    return digest
+
+
+def replace(source, target):
+    # py 2.7
+    if hasattr(os, 'replace'):
+        os.replace(source, target)
+    else:
+        if os.path.isfile(target):
+            os.remove(target)
+        os.rename(source, target)
+
+
+def _copy_kernel(fsrc, fdst, callback=None, cancelled=None):
+    # returns False if nothing was copied and the fallback should be used
+    if hasattr(os, 'copy_file_range'):
+        func = _copy_file_range
+    elif hasattr(os, 'sendfile') and os.name == 'posix':
+        func = _sendfile
+    else:
+        return False
+
+    infd = fsrc.fileno()
+    outfd = fdst.fileno()
+    offset = 0
+    while True:
+        if cancelled and cancelled():
+            raise CopyCancelled
+        try:
+            sent = func(infd, outfd, offset)
+        except OSError as e:
+            # unsupported file systems or devices
+            if offset == 0 and e.errno in _fallback_errors:
+                return False
+            raise
+        if not sent:
+            break
+        offset += sent
+        if callback:
+            callback(sent)
+    return True
+
+
+def _copy_file_range(infd, outfd, offset):
+    return os.copy_file_range(infd, outfd, CHUNK_SIZE, offset, offset)
+
+
+def _sendfile(infd, outfd, offset):
+    return os.sendfile(outfd, infd, offset, CHUNK_SIZE)
+
+
+def _copy_buffered(fsrc, fdst, callback=None, cancelled=None, sha1=None):
+    while True:
+        if cancelled and cancelled():
+            raise CopyCancelled
+        buffer = fsrc.read(BUFFER_SIZE)
+        if not buffer:
+            break
+        fdst.write(buffer)
+        if sha1 is not None:
+            sha1.update(buffer)
+        if callback:
+            callback(len(buffer))
+
+
+class Progress(object):
+    # sums up bytes reported by many threads and calls callback with whole percents
+    def __init__(self, total, callback):
+        self.total = total
+        self.callback = callback
+        self.value = 0
+        self.percent = -1
+        self.lock = threading.Lock()
+
+    def add(self, value):
+        with self.lock:
+            self.value += value
+            percent = int(self.value * 100 / self.total) if self.total else 100
+            if percent == self.percent:
+                return
+            self.percent = percent
+        self.callback(percent)
+
+
+class CopyJob(QtCore.QRunnable):
+    def __init__(self, engine, source, target, callback=None, cancelled=None, journal=None):
+        super(CopyJob, self).__init__()
+        self.engine = engine
+        self.source = source
+        self.target = target
+        self.callback = callback
+        self.cancelled = cancelled
+        self.journal = journal
+
+        self.error = None
+        self.done = threading.Event()
+
+    def run(self):
+        try:
+            semaphores = self.engine.semaphores(self.source, self.target)
+            for semaphore in semaphores:
+                semaphore.acquire()
+            try:
+                digest = copy_file(
+                    self.source, self.target, self.callback, self.cancelled,
+                    checksum=self.journal is not None)
+                if self.journal is not None:
+                    self.journal.add(self.source, self.target, digest)
+            finally:
+                for semaphore in reversed(semaphores):
+                    semaphore.release()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+
+class CopyEngine(object):
+    """Copies files on a bounded pool of threads.
+
+    Every file is a job of its own, so the files of a sequence are copied in
+    parallel. The number of copies running at the same time is also limited
+    per source and per destination device, so a slow network share does
+    not occupy every thread.
+    """
+
+    def __init__(self, threads=8, device_limit=4):
+        self.pool = QtCore.QThreadPool()
+        self.pool.setMaxThreadCount(threads)
+        self.device_limit = device_limit
+
+        self.lock = threading.Lock()
+        # {st_dev: Semaphore}
+        self.devices = {}
+
+    @property
+    def threads(self):
+        return self.pool.maxThreadCount()
+
+    def semaphores(self, source, target):
+        # sorted by device so that jobs always acquire them in the same order
+        devices = set()
+        devices.add(os.stat(source).st_dev)
+        devices.add(os.stat(os.path.dirname(os.path.abspath(target))).st_dev)
+
+        semaphores = []
+        with self.lock:
+            for device in sorted(devices):
+                semaphore = self.devices.get(device)
+                if semaphore is None:
+                    semaphore = threading.Semaphore(self.device_limit)
+                    self.devices[device] = semaphore
+                semaphores.append(semaphore)
+        return semaphores
+
+    def copy(self, paths, callback=None, cancelled=None, journal=None):
+        """Copies [(source, target), ...] and waits for all files.
+
+        Every copied file is added to the journal if one is given. Raises the
+        first error after all jobs have finished.
+        """
+
+        jobs = []
+        for source, target in paths:
+            job = CopyJob(self, source, target, callback, cancelled, journal)
+            job.setAutoDelete(False)
+            jobs.append(job)
+            self.pool.start(job)
+
+        for job in jobs:
+            job.done.wait()
+
+        for job in jobs:
+            if job.error is not None:
+                raise job.error
+
+
+class Journal(object):
+    """Log of the files copied by relocate, used to resume a run.
+
+    Every copied file is appended as a json line with its source, target,
+    size, mtime and hash. A later run skips targets that still have the
+    recorded size, mtime and hash without reading their sources again.
+    """
+
+    _journals = {}
+    _lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        # {target: entry}
+        self.entries = {}
+
+    @classmethod
+    def from_target(cls, target_dir, cache_dir):
+        # one journal per target directory, shared by all threads
+        target_dir = os.path.normpath(os.path.abspath(target_dir))
+        with cls._lock:
+            journal = cls._journals.get(target_dir)
+            if journal is None:
+                key = hashlib.md5(target_dir.encode('utf-8')).hexdigest()
+                path = os.path.join(cache_dir, 'relocate_journal', '{}.jsonl'.format(key))
+                journal = cls(path)
+                cls._journals[target_dir] = journal
+        journal.read()
+        return journal
+
+    def read(self):
+        entries = {}
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line of an interrupted run
+                        continue
+                    entries[entry['target']] = entry
+        except (IOError, OSError):
+            pass
+        with self.lock:
+            self.entries = entries
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def verified(self, source, target):
+        # whether target is a complete copy of source according to the journal
+        with self.lock:
+            entry = self.entries.get(target)
+        if entry is None or entry['source'] != source or not entry.get('hash'):
+            return False
+        try:
+            stat = os.stat(target)
+            if stat.st_size != entry['size'] or stat.st_mtime != entry['mtime']:
+                return False
+            # the content can change without changing size and mtime
+            return file_hash(target) == entry['hash']
+        except (IOError, OSError):
+            return False
+
+    def add(self, source, target, digest=None):
+        stat = os.stat(target)
+        entry = {
+            'source': source,
+            'target': target,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'hash': digest,
+            }
+        with self.lock:
+            self.entries[target] = entry
+            try:
+                dirpath = os.path.dirname(self.path)
+                if not os.path.isdir(dirpath):
+                    os.makedirs(dirpath)
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+            except (IOError, OSError) as e:
+                logging.warning('Could not write relocate journal: {} ({})'.format(self.path, e))
+
+
+def file_hash(path):
+    # streamed, so large files are never read into memory at once
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            buffer = f.read(BUFFER_SIZE)
+            if not buffer:
+                break
+            sha1.update(buffer)
+    return sha1.hexdigest()
+
+
+def same_device(source, target_dir):
+    # whether source can be renamed into target_dir
+    return os.stat(source).st_dev == os.stat(target_dir).st_dev
+
+
+def link_file(source, target):
+    # hard links target to source, copies if the file system cannot link
+    if os.path.isfile(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except (AttributeError, OSError):
+        # py 2.7 has no os.link on windows
+        copy_file(source, target)
+
+
+class Deduplicator(object):
+    """Copies every unique file content of a relocate only once.
+
+    Sources are compared by size first and only hashed if another source has
+    the same size. The first source with a content claims it, later sources
+    with the same content reuse the target of the first copy once it is
+    released.
+    """
+
+    def __init__(self, paths):
+        self.paths = set(paths)
+        self.lock = threading.Lock()
+
+        self.sizes = None
+        self.hashes = {}
+        # {fingerprint: (target, Event)}
+        self.claims = {}
+
+    def prepare(self):
+        with self.lock:
+            if self.sizes is not None:
+                return
+            sizes = {}
+            for path in self.paths:
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                sizes[size] = sizes.get(size, 0) + 1
+            self.sizes = sizes
+
+    def fingerprint(self, path):
+        self.prepare()
+        size = os.path.getsize(path)
+        if self.sizes.get(size, 0) < 2 and path in self.paths:
+            return (size,)
+        digest = self.hashes.get(path)
+        if digest is None:
+            digest = file_hash(path)
+            self.hashes[path] = digest
+        return (size, digest)
+
+    def claim(self, source, target):
+        """Claims the content of source for target.
+
+        Returns the fingerprint and None if source has to be copied to target,
+        otherwise the target of the first source with the same content.
+        """
+
+        key = self.fingerprint(source)
+        with self.lock:
+            claim = self.claims.get(key)
+            if claim is None:
+                self.claims[key] = (target, threading.Event())
+                return key, None
+        return key, claim[0]
+
+    def wait(self, key):
+        # waits until the first copy of the content is done or failed
+        self.claims[key][1].wait()
+
+    def release(self, key):
+        self.claims[key][1].set()
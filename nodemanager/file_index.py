@@ -0,0 +1,314 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from . import copy_engine
+
+
+class FileIndex(object):
+    """Index of the files below a search root, persisted between sessions.
+
+    Every directory is stored with its mtime, its file names and its sub
+    directory names. A refresh only lists directories whose mtime changed,
+    unchanged directories cost a single stat.
+    """
+
+    version = 1
+
+    _indexes = {}
+    _lock = threading.Lock()
+
+    def __init__(self, root, path=''):
+        self.root = os.path.normpath(os.path.abspath(root))
+        self.path = path
+        self.lock = threading.RLock()
+
+        # {dirpath: (mtime, filenames, dirnames)}
+        self.directories = {}
+        # {filename: [dirpath, ...]}
+        self.files = {}
+
+    def __repr__(self):
+        return 'FileIndex({})'.format(self.root)
+
+    @classmethod
+    def from_root(cls, root, cache_dir):
+        # share one index per root between all threads
+        root = os.path.normpath(os.path.abspath(root))
+        with cls._lock:
+            index = cls._indexes.get(root)
+            if index is None:
+                key = hashlib.md5(root.encode('utf-8')).hexdigest()
+                path = os.path.join(cache_dir, 'file_index', '{}.json'.format(key))
+                index = cls(root, path)
+                index.read()
+                cls._indexes[root] = index
+        return index
+
+    def read(self):
+        if not self.path or not os.path.isfile(self.path):
+            return False
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            logging.warning('Could not read file index: {} ({})'.format(self.path, e))
+            return False
+
+        if data.get('version') != self.version or data.get('root') != self.root:
+            return False
+
+        with self.lock:
+            self.directories = {
+                dirpath: (mtime, filenames, dirnames)
+                for dirpath, (mtime, filenames, dirnames) in data['directories'].items()}
+            self.update_files()
+        return True
+
+    def write(self):
+        if not self.path:
+            return False
+
+        with self.lock:
+            data = {
+                'version': self.version,
+                'root': self.root,
+                'directories': self.directories,
+                }
+
+        try:
+            dirpath, filename = os.path.split(self.path)
+            if not os.path.isdir(dirpath):
+                try:
+                    os.makedirs(dirpath)
+                except OSError:
+                    if not os.path.isdir(dirpath):
+                        raise
+            # unique temp file, other sessions can write the same index
+            fd, tmp_path = tempfile.mkstemp(prefix='{}.'.format(filename), suffix='.tmp', dir=dirpath)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f)
+                copy_engine.replace(tmp_path, self.path)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+        except (IOError, OSError) as e:
+            logging.warning('Could not write file index: {} ({})'.format(self.path, e))
+            return False
+        return True
+
+    def refresh(self):
+        # returns the number of directories that had to be listed
+        with self.lock:
+            directories = {}
+            listed = 0
+
+            stack = [self.root]
+            while stack:
+                dirpath = stack.pop()
+                try:
+                    mtime = os.stat(dirpath).st_mtime
+                except OSError:
+                    continue
+
+                entry = self.directories.get(dirpath)
+                if entry is None or entry[0] != mtime:
+                    try:
+                        filenames, dirnames = self.list_directory(dirpath)
+                    except OSError:
+                        continue
+                    entry = (mtime, filenames, dirnames)
+                    listed += 1
+
+                directories[dirpath] = entry
+                # reversed to walk top-down in alphabetical order
+                for dirname in reversed(entry[2]):
+                    stack.append(os.path.join(dirpath, dirname))
+
+            changed = listed or len(directories) != len(self.directories)
+            self.directories = directories
+            if changed:
+                self.update_files()
+                self.write()
+        return listed
+
+    def update_files(self):
+        files = {}
+        # sort by depth so that directories closer to the root come first
+        for dirpath in sorted(self.directories, key=lambda d: (d.count(os.sep), d)):
+            for filename in self.directories[dirpath][1]:
+                files.setdefault(filename, []).append(dirpath)
+        self.files = files
+
+    def find(self, filename, regex=None):
+        # returns all directories that contain filename or a file matching regex
+        with self.lock:
+            if regex is None:
+                return list(self.files.get(filename, []))
+
+            directories = []
+            for name, dirpaths in self.files.items():
+                if full_match(regex, name):
+                    directories.extend(d for d in dirpaths if d not in directories)
+            directories.sort(key=lambda d: (d.count(os.sep), d))
+            return directories
+
+    def match(self, matcher):
+        # returns {key: [dirpath, ...]} for all keys of the matcher in one pass
+        results = {}
+        with self.lock:
+            for name, dirpaths in self.files.items():
+                for key in matcher.match(name):
+                    directories = results.setdefault(key, [])
+                    directories.extend(d for d in dirpaths if d not in directories)
+        for directories in results.values():
+            directories.sort(key=lambda d: (d.count(os.sep), d))
+        return results
+
+    @staticmethod
+    def list_directory(dirpath):
+        filenames = []
+        dirnames = []
+        # py 2.7
+        if hasattr(os, 'scandir'):
+            for entry in os.scandir(dirpath):
+                # do not follow links into other directories, same as os.walk
+                if entry.is_dir(follow_symlinks=False):
+                    dirnames.append(entry.name)
+                elif not entry.is_dir():
+                    filenames.append(entry.name)
+        else:
+            for name in os.listdir(dirpath):
+                path = os.path.join(dirpath, name)
+                if os.path.isdir(path):
+                    if not os.path.islink(path):
+                        dirnames.append(name)
+                else:
+                    filenames.append(name)
+        filenames.sort()
+        dirnames.sort()
+        return filenames, dirnames
+
+
+class FileMatcher(object):
+    """Matches file names against many nodes in a single pass.
+
+    Plain file names are looked up in a dictionary. File sequence patterns are
+    grouped by the literal prefix in front of the first sequence tag, so a
+    name is only tested against the patterns that share its prefix.
+    """
+
+    def __init__(self):
+        # {filename: [key, ...]}
+        self.names = {}
+        # {prefix: [(regex, key), ...]}
+        self.prefixes = {}
+        self.prefix_lengths = []
+
+    def __len__(self):
+        return (
+            sum(len(keys) for keys in self.names.values()) +
+            sum(len(patterns) for patterns in self.prefixes.values()))
+
+    def add(self, key, filename, regex=None, prefix=''):
+        if regex is None:
+            self.names.setdefault(filename, []).append(key)
+        else:
+            self.prefixes.setdefault(prefix, []).append((regex, key))
+            if len(prefix) not in self.prefix_lengths:
+                self.prefix_lengths.append(len(prefix))
+                self.prefix_lengths.sort()
+
+    def match(self, name):
+        keys = list(self.names.get(name, []))
+        for length in self.prefix_lengths:
+            if length > len(name):
+                break
+            for regex, key in self.prefixes.get(name[:length], []):
+                if full_match(regex, name):
+                    keys.append(key)
+        return keys
+
+
+class DirectoryCache(object):
+    """Shared cache of directory listings keyed by directory and mtime.
+
+    Listings younger than ttl seconds are returned as is, older ones are
+    validated with a stat and only listed again if the mtime changed. The
+    least recently used directories are evicted once size is exceeded.
+    """
+
+    def __init__(self, size=1024, ttl=2.0):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+        # {dirpath: (mtime, checked, filenames)}
+        self.entries = OrderedDict()
+
+    def listdir(self, dirpath):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.pop(dirpath, None)
+            if entry is not None:
+                self.entries[dirpath] = entry
+                if now - entry[1] < self.ttl:
+                    return entry[2]
+
+        try:
+            mtime = os.stat(dirpath).st_mtime
+            if entry is not None and entry[0] == mtime:
+                filenames = entry[2]
+            else:
+                filenames = tuple(os.listdir(dirpath))
+        except OSError:
+            with self.lock:
+                self.entries.pop(dirpath, None)
+            raise
+
+        with self.lock:
+            self.entries.pop(dirpath, None)
+            self.entries[dirpath] = (mtime, now, filenames)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return filenames
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def full_match(regex, name):
+    # py 2.7 has no fullmatch, sequence regexes are not anchored
+    match = regex.match(name)
+    return match is not None and match.end() == len(name)
+
+
+_sequence_regexes = {}
+_sequence_regexes_lock = threading.Lock()
+
+
+def sequence_regex(filename, tags):
+    # compiled patterns are memoized per filename
+    key = (filename, tuple(tags))
+    regex = _sequence_regexes.get(key)
+    if regex is None:
+        # to match escaped filename escape the escaped tags
+        pattern = '|'.join(map(re.escape, map(re.escape, tags)))
+        file_pattern = re.sub(pattern, r'\\d+', re.escape(filename), re.IGNORECASE)
+        regex = re.compile(file_pattern)
+        with _sequence_regexes_lock:
+            if len(_sequence_regexes) > 4096:
+                _sequence_regexes.clear()
+            _sequence_regexes[key] = regex
+    return regex
@@ -0,0 +1,416 @@
+"""
+Filter expressions for the attribute table, for example:
+
+    file_size > 50MB and status == NOT_FOUND and directory ~ /raw/
+
+Comparisons are written as `attribute operator value` and can be combined with
+`and`, `or`, `not` and parentheses. Supported operators are `==`, `!=`, `<`,
+`<=`, `>`, `>=`, `~` (regex search) and `!~`. Values are numbers with an
+optional size unit (KB, MB, GB, TB), quoted strings, /regular expressions/
+or bare words such as enum names. String comparisons ignore case.
+"""
+
+import bisect
+import re
+import sys
+try:
+    from enum import Enum
+except ImportError:
+    from .enum import Enum
+
+from . import utils
+
+
+# py 2.7
+if sys.version_info[0] >= 3:
+    unicode = str
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+_token_regex = re.compile(r'''
+    \s*(?:
+        (?P<paren>[()])|
+        (?P<op>==|!=|<=|>=|!~|<|>|~|=)|
+        (?P<regex>/(?:[^/\\]|\\.)*/)|
+        (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')|
+        (?P<number>-?\d+(?:\.\d+)?(?:[kmgt]b)?(?![\w.]))|
+        (?P<word>[^\s()=!<>~"']+)
+    )''', re.VERBOSE | re.IGNORECASE)
+
+_size_factors = {
+    'kb': 1 << 10,
+    'mb': 1 << 20,
+    'gb': 1 << 30,
+    'tb': 1 << 40,
+    }
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _token_regex.match(text, position)
+        if not match or match.end() == position:
+            raise ExpressionError('Invalid syntax at: {}'.format(text[position:]))
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+def parse(text, attributes=None):
+    """Parses text and returns the root node of the expression.
+
+    If attributes are given, attribute names are resolved against them and an
+    ExpressionError is raised for unknown attributes.
+    """
+    parser = Parser(tokenize(text), attributes)
+    return parser.parse()
+
+
+class Parser(object):
+    def __init__(self, tokens, attributes=None):
+        self.tokens = tokens
+        self.position = 0
+        self.attributes = attributes
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def keyword(self, word):
+        kind, value = self.peek()
+        return kind == 'word' and value.lower() == word
+
+    def parse(self):
+        if not self.tokens:
+            raise ExpressionError('Empty expression')
+        node = self.parse_or()
+        if self.position < len(self.tokens):
+            raise ExpressionError('Unexpected token: {}'.format(self.peek()[1]))
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.keyword('or'):
+            self.next()
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else Or(nodes)
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while self.keyword('and'):
+            self.next()
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else And(nodes)
+
+    def parse_not(self):
+        if self.keyword('not'):
+            self.next()
+            return Not(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, value = self.next()
+        if kind == 'paren' and value == '(':
+            node = self.parse_or()
+            kind, value = self.next()
+            if kind != 'paren' or value != ')':
+                raise ExpressionError('Missing closing parenthesis')
+            return node
+        elif kind == 'word':
+            attribute = self.attribute(value)
+            op_kind, op = self.next()
+            if op_kind != 'op':
+                raise ExpressionError('Expected operator after: {}'.format(value))
+            if op == '=':
+                op = '=='
+            return Comparison(attribute, op, self.parse_value(op))
+        elif kind is None:
+            raise ExpressionError('Unexpected end of expression')
+        raise ExpressionError('Unexpected token: {}'.format(value))
+
+    def parse_value(self, op):
+        kind, value = self.next()
+        if kind == 'number':
+            return self.number(value)
+        elif kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'regex':
+            value = value[1:-1].replace('\\/', '/')
+        elif kind == 'word':
+            if value.lower() in ('true', 'false'):
+                return value.lower() == 'true'
+        else:
+            raise ExpressionError('Expected value after: {}'.format(op))
+
+        if op in ('~', '!~'):
+            try:
+                return re.compile(value, re.IGNORECASE)
+            except re.error as e:
+                raise ExpressionError('Invalid regex: {}'.format(e))
+        return value
+
+    def attribute(self, name):
+        if self.attributes is None:
+            return name
+        if name in self.attributes:
+            return name
+        for attribute in self.attributes:
+            if attribute.lower() == name.lower():
+                return attribute
+        raise ExpressionError('Unknown attribute: {}'.format(name))
+
+    @staticmethod
+    def number(text):
+        factor = 1
+        unit = text[-2:].lower()
+        if unit in _size_factors:
+            factor = _size_factors[unit]
+            text = text[:-2]
+        value = float(text) * factor
+        if value.is_integer():
+            value = int(value)
+        return value
+
+
+class Node(object):
+    # cost is used to evaluate cheap and selective operands first
+    def cost(self, table):
+        return 2
+
+    def rows(self, table, candidates=None):
+        # returns the set of rows that match, restricted to candidates
+        raise NotImplementedError
+
+    def test(self, table, row):
+        # returns whether a single row matches, without using the indexes
+        raise NotImplementedError
+
+
+class And(Node):
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def __repr__(self):
+        return 'And({})'.format(self.nodes)
+
+    def cost(self, table):
+        return min(node.cost(table) for node in self.nodes)
+
+    def rows(self, table, candidates=None):
+        for node in sorted(self.nodes, key=lambda n: n.cost(table)):
+            candidates = node.rows(table, candidates)
+            if not candidates:
+                break
+        return candidates
+
+    def test(self, table, row):
+        return all(node.test(table, row) for node in self.nodes)
+
+
+class Or(Node):
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def __repr__(self):
+        return 'Or({})'.format(self.nodes)
+
+    def cost(self, table):
+        return max(node.cost(table) for node in self.nodes)
+
+    def rows(self, table, candidates=None):
+        rows = set()
+        for node in self.nodes:
+            rows |= node.rows(table, candidates)
+        return rows
+
+    def test(self, table, row):
+        return any(node.test(table, row) for node in self.nodes)
+
+
+class Not(Node):
+    def __init__(self, node):
+        self.node = node
+
+    def __repr__(self):
+        return 'Not({})'.format(self.node)
+
+    def cost(self, table):
+        return self.node.cost(table)
+
+    def rows(self, table, candidates=None):
+        if candidates is None:
+            candidates = set(range(table.row_count()))
+        return candidates - self.node.rows(table, candidates)
+
+    def test(self, table, row):
+        return not self.node.test(table, row)
+
+
+class Comparison(Node):
+    def __init__(self, attribute, op, value):
+        self.attribute = attribute
+        self.op = op
+        self.value = value
+
+    def __repr__(self):
+        return 'Comparison({} {} {!r})'.format(self.attribute, self.op, self.value)
+
+    def cost(self, table):
+        # estimated from the operator, indexes are not built to compare costs
+        if self.op in ('~', '!~'):
+            return 3
+        index = table.cached_index(self.attribute)
+        if self.op in ('==', '!='):
+            return 0 if index is None or index.values else 2
+        return 1 if index is None or index.numbers else 2
+
+    def rows(self, table, candidates=None):
+        rows = None
+        if self.op not in ('~', '!~'):
+            # an index is only built for the whole column, narrowed down
+            # candidates are cheaper to scan
+            index = table.cached_index(self.attribute)
+            if index is None and candidates is None:
+                index = table.index(self.attribute)
+
+            if index is None:
+                pass
+            elif self.op in ('==', '!=') and index.values:
+                rows = index.equal(self.value)
+                if self.op == '!=':
+                    rows = set(range(table.row_count())) - rows
+            elif self.op in ('<', '<=', '>', '>=') and index.numbers:
+                rows = index.compare(self.op, self.value)
+
+        if rows is not None:
+            if candidates is not None:
+                rows &= candidates
+            return rows
+
+        # scan the cached values of the candidates
+        if candidates is None:
+            values = table.values(self.attribute)
+            return set(row for row in range(len(values)) if self.match(values[row]))
+        return set(row for row in candidates if self.match(table.value(self.attribute, row)))
+
+    def test(self, table, row):
+        return self.match(table.value(self.attribute, row))
+
+    def match(self, item_value):
+        op = self.op
+        value = self.value
+        item_value = normalize(item_value)
+
+        if op in ('~', '!~'):
+            found = bool(value.search(text(item_value)))
+            return found if op == '~' else not found
+
+        if isinstance(item_value, Enum):
+            if isinstance(value, (int, float)):
+                item_value = item_value.value
+            else:
+                item_value = item_value.name.lower()
+                value = text(value).lower()
+        elif isinstance(item_value, (str, unicode)):
+            item_value = item_value.lower()
+            value = text(value).lower()
+
+        try:
+            if op == '==':
+                return item_value == value
+            elif op == '!=':
+                return item_value != value
+            elif op == '<':
+                return item_value < value
+            elif op == '<=':
+                return item_value <= value
+            elif op == '>':
+                return item_value > value
+            elif op == '>=':
+                return item_value >= value
+        except TypeError:
+            return False
+        return False
+
+
+class ColumnIndex(object):
+    """Lookup structures built from the values of one column.
+
+    Numeric columns get a sorted array of (value, row) for range queries,
+    enums and booleans get a map of value to the set of rows.
+    """
+
+    def __init__(self, values):
+        self.size = len(values)
+        self.numbers = None
+        self.values = None
+
+        normalized = [normalize(value) for value in values]
+        if normalized and all(is_number(value) for value in normalized):
+            pairs = sorted((value, row) for row, value in enumerate(normalized))
+            self.numbers = [value for value, row in pairs]
+            self.number_rows = [row for value, row in pairs]
+        elif normalized and all(isinstance(value, (Enum, bool)) for value in normalized):
+            self.values = {}
+            for row, value in enumerate(normalized):
+                self.values.setdefault(value, set()).add(row)
+
+    def equal(self, value):
+        rows = set()
+        for key, key_rows in self.values.items():
+            if isinstance(key, Enum):
+                if isinstance(value, (int, float)):
+                    matches = key.value == value
+                else:
+                    matches = key.name.lower() == text(value).lower()
+            else:
+                matches = key == value
+            if matches:
+                rows |= key_rows
+        return rows
+
+    def compare(self, op, value):
+        if not is_number(value):
+            return set()
+        if op == '<':
+            return set(self.number_rows[:bisect.bisect_left(self.numbers, value)])
+        elif op == '<=':
+            return set(self.number_rows[:bisect.bisect_right(self.numbers, value)])
+        elif op == '>':
+            return set(self.number_rows[bisect.bisect_right(self.numbers, value):])
+        elif op == '>=':
+            return set(self.number_rows[bisect.bisect_left(self.numbers, value):])
+        return set()
+
+
+def normalize(value):
+    # file sizes compare as bytes
+    if isinstance(value, utils.FileSize):
+        return int(value)
+    return value
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def text(value):
+    if isinstance(value, list):
+        return ', '.join(map(text, value))
+    elif isinstance(value, Enum):
+        return value.name
+    elif isinstance(value, (str, unicode)):
+        return value
+    return str(value)
@@ -2,14 +2,18 @@ import logging
 import os
 import re
 import shutil
+import threading
 from collections import OrderedDict
 from enum import Enum
 
 from PySide2 import QtCore
 
+from . import copy_engine
+from . import file_index
 from . import plugin_utils
 from . import utils
 from . import processing
+from . import tx_cache
 from . import util_dialog
 
 
@@ -84,6 +88,8 @@ class Node(object):
     node = None
     attributes = []
     locked_attributes = []
+    # attributes that only query the file system and can be resolved in a thread
+    filesystem_attributes = []
 
     def __init__(self, node):
         self.node = node
@@ -91,6 +97,7 @@ class Node(object):
         self.attributes = [
             'name'
             ]
+        self.locked_attributes = []
 
     def __repr__(self):
         return 'Node({})'.format(self.name)
@@ -102,9 +109,60 @@ class Node(object):
     def name(self):
         return str(self.node)
 
+    @classmethod
+    def attach(cls, nodes):
+        # nodes that are read together, dcc nodes can prepare bulk reads for them
+        pass
+
+    def invalidate(self):
+        # called before the node is read again, drops values cached by dcc nodes
+        pass
+
+    @classmethod
+    def set_attributes(cls, edits):
+        # applies [(node, attribute, value), ...] and returns the applied edits,
+        # dcc nodes can override this to apply all edits as one operation
+        applied = []
+        for node, attribute, value in edits:
+            # a failing edit, for example a locked attribute, must not drop
+            # the edits of the other nodes
+            try:
+                setattr(node, attribute, value)
+            except Exception as e:
+                logging.warning('Could not set attribute: {}.{} ({})'.format(node, attribute, e))
+                continue
+            applied.append((node, attribute, value))
+        return applied
+
+
+def attach(nodes):
+    # prepares bulk reads of nodes grouped by node class
+    groups = OrderedDict()
+    for node in nodes:
+        groups.setdefault(type(node), []).append(node)
+
+    for cls, cls_nodes in groups.items():
+        cls.attach(cls_nodes)
+
+
+def set_attributes(edits):
+    # bulk write of [(node, attribute, value), ...] grouped by node class
+    groups = OrderedDict()
+    for edit in edits:
+        groups.setdefault(type(edit[0]), []).append(edit)
+
+    applied = []
+    for cls, cls_edits in groups.items():
+        applied.extend(cls.set_attributes(cls_edits))
+    return applied
+
 
 class FileNode(Node):
     _file_sequence_tags = ['<udim>', '<frameNum>', '<uvtile>']
+    filesystem_attributes = ['status', 'file_size']
+
+    # directory listings shared by all nodes and runnables
+    directory_cache = file_index.DirectoryCache()
 
     def __init__(self, node):
         super(FileNode, self).__init__(node)
@@ -115,7 +173,7 @@ class FileNode(Node):
             'filename',
             'directory',
             ])
-        self.locked_attributes.extend(['status', 'file_size'])
+        self.locked_attributes.extend(self.filesystem_attributes)
 
     @property
     def filepath(self):
@@ -153,11 +211,12 @@ class FileNode(Node):
     def file_sequence(self):
         if self.is_file_sequence:
             regex = self.file_sequence_regex
+            directory = self.directory
 
             try:
-                for filename in os.listdir(self.directory):
-                    if regex.search(filename):
-                        yield os.path.join(self.directory, filename)
+                for filename in self.directory_cache.listdir(directory):
+                    if file_index.full_match(regex, filename):
+                        yield os.path.join(directory, filename)
             except OSError:
                 return
         else:
@@ -165,11 +224,7 @@ class FileNode(Node):
 
     @property
     def file_sequence_regex(self):
-        # to match escaped filename escape the escaped tags
-        tags = '|'.join(map(re.escape, map(re.escape, self._file_sequence_tags)))
-        file_pattern = re.sub(tags, r'\\d+', re.escape(self.filename), re.IGNORECASE)
-        regex = re.compile(file_pattern)
-        return regex
+        return file_index.sequence_regex(self.filename, self._file_sequence_tags)
 
     @property
     def real_filepath(self):
@@ -188,43 +243,81 @@ class FileNode(Node):
     def file_size(self):
         return utils.FileSize.from_file(self.real_filepath)
 
+    def file_info(self):
+        # copy of the file attributes that can be used outside of the main thread
+        return FileInfo(self.filepath)
+
+
+class FileInfo(FileNode):
+    def __init__(self, filepath):
+        super(FileInfo, self).__init__(filepath)
+        self._filepath = filepath
+
+    @property
+    def filepath(self):
+        return self._filepath
+
+
+class LocateBatch(object):
+    """Resolves the directories of all nodes of a locate run at once.
+
+    The file names and sequence patterns of all nodes are collected up front,
+    the first runnable that asks for a result refreshes the index and matches
+    every node in a single pass over it.
+    """
+
+    def __init__(self, nodes):
+        self.matcher = file_index.FileMatcher()
+        self.results = {}
+        self.lock = threading.Lock()
+
+        for node in nodes:
+            filename = node.filename
+            if not filename:
+                continue
+            if node.is_file_sequence:
+                tags = [filename.find(tag) for tag in node._file_sequence_tags if tag in filename]
+                prefix = filename[:min(tags)]
+                self.matcher.add(node, filename, node.file_sequence_regex, prefix)
+            else:
+                self.matcher.add(node, filename)
+
+    def find(self, index, node, logger=None):
+        with self.lock:
+            results = self.results.get(index.root)
+            if results is None:
+                if logger:
+                    logger.info('Updating file index: {}'.format(index.root))
+                listed = index.refresh()
+                if logger:
+                    logger.info('Directories listed: {}'.format(listed))
+                    logger.info('Matching {} files.'.format(len(self.matcher)))
+                results = index.match(self.matcher)
+                self.results[index.root] = results
+        return results.get(node, [])
+
 
 class LocateRunnable(processing.ProcessingRunnable):
-    cache = []
+    snapshot_attributes = ['filename', 'is_file_sequence', 'file_sequence_regex']
+    batch = None
 
     def process(self):
         if not self.node.filename:
             return True
 
-        self.logger.info('Searching recursivly: {}'.format(self.kwargs['path']))
+        cache_dir = utils.Settings().settings_path
+        index = file_index.FileIndex.from_root(self.kwargs['path'], cache_dir)
 
-        regex = self.node.file_sequence_regex
-        self.logger.info('Regex pattern: {}'.format(regex))
+        # locate() shares one batch between all runnables of a run
+        batch = self.batch or LocateBatch([self.item.node])
+        directories = batch.find(index, self.item.node, self.logger)
 
-        # lock contents of cache
-        cache = list(self.cache)
-        for root in cache:
-            for file in os.listdir(root):
-                if not self.running:
-                    return
-                filepath = os.path.join(root, file)
-                if regex.search(filepath):
-                    self.set_directory(root)
-                    return True
+        if not self.running:
+            return
 
-        for root, dirs, files in os.walk(self.kwargs['path']):
-            if root in cache:
-                continue
-            for file in files:
-                if not self.running:
-                    return
-                filepath = os.path.join(root, file)
-                if regex.search(filepath):
-                    # still check since other instances could have added it
-                    if root not in self.cache:
-                        LocateRunnable.cache.append(root)
-                    self.set_directory(root)
-                    return True
+        if directories:
+            self.set_directory(directories[0])
+            return True
 
         raise FileNotFoundError
 
@@ -237,15 +330,35 @@ class LocateRunnable(processing.ProcessingRunnable):
 
 
 class RelocateRunnable(processing.ProcessingRunnable):
-    moved = []
+    snapshot_attributes = ['filepath', 'file_sequence']
+    in_flight = processing.InFlightRegistry()
+    engine = None
+    dedupe = None
+    journal = None
 
     def process(self):
+        # nodes that share a file wait for the first runnable that relocates it
+        filepath = self.node.filepath
+        owner = self.in_flight.acquire(filepath, lambda: self.running)
+        if owner is None:
+            return
+        if not owner:
+            self.logger.info('File relocated by a different thread.')
+            return self.relocate(True)
+
+        success = False
+        try:
+            success = self.relocate()
+        finally:
+            self.in_flight.release(filepath, bool(success))
+        return success
+
+    def relocate(self, update_directory=False):
+        # update_directory is set if another thread already moved the files
         target_dir = self.kwargs['path']
-        update_directory = False
-
-        if self.node.filepath in RelocateRunnable.moved:
-            update_directory = True
 
+        copies = []
+        moves = []
         for source_path in self.node.file_sequence:
             if not self.running:
                 return
@@ -257,8 +370,21 @@ class RelocateRunnable(processing.ProcessingRunnable):
             target_path = os.path.join(target_dir, os.path.basename(source_path))
 
             if not os.path.exists(target_dir):
-                self.logger.info('Directory created: {}'.format(target_dir))
-                os.makedirs(target_dir)
+                try:
+                    os.makedirs(target_dir)
+                    self.logger.info('Directory created: {}'.format(target_dir))
+                except OSError:
+                    # created by another thread
+                    if not os.path.isdir(target_dir):
+                        raise
+
+            if self.journal is not None and self.journal.verified(source_path, target_path):
+                self.logger.info('Target file verified by journal: {}'.format(target_path))
+                if not self.kwargs['copy'] and os.path.isfile(source_path):
+                    # an interrupted move copied the file but kept the source
+                    os.remove(source_path)
+                update_directory = True
+                continue
 
             if os.path.isfile(source_path):
                 if (os.path.isfile(target_path) and
@@ -267,29 +393,168 @@ class RelocateRunnable(processing.ProcessingRunnable):
                     continue
 
                 if self.kwargs['copy']:
-                    self.logger.info('File copied: {}'.format(target_path))
-                    shutil.copy(source_path, target_dir)
-                else:
+                    copies.append((source_path, target_path))
+                elif copy_engine.same_device(source_path, target_dir):
                     self.logger.info('File moved: {}'.format(target_path))
                     shutil.move(source_path, target_dir)
-                    # other threads might have already moved the files
-                    RelocateRunnable.moved.append(self.node.filepath)
+                else:
+                    # moves to other devices are copies, the source is only
+                    # removed once the copy is complete and journaled
+                    moves.append((source_path, target_path))
                 update_directory = True
 
+        if copies:
+            try:
+                if self.dedupe is not None:
+                    target_dir = self.copy_unique(copies, target_dir)
+                else:
+                    self.copy(copies)
+            except copy_engine.CopyCancelled:
+                return
+
+        if moves:
+            try:
+                self.copy(moves)
+            except copy_engine.CopyCancelled:
+                return
+            for source_path, target_path in moves:
+                os.remove(source_path)
+                self.logger.info('File moved: {}'.format(target_path))
+
         if not self.kwargs['ignore_update'] and update_directory:
             self.node.directory = target_dir
         return True
 
+    def copy(self, paths):
+        # copy the files in parallel and report the progress in bytes
+        total = sum(os.path.getsize(source_path) for source_path, target_path in paths)
+        self.logger.info('Copying {} files ({}).'.format(len(paths), utils.FileSize(total)))
+        progress = copy_engine.Progress(total, self.item._progress)
+
+        def cancelled():
+            return not self.running
+
+        if self.engine is not None:
+            self.engine.copy(paths, progress.add, cancelled, self.journal)
+        else:
+            for source_path, target_path in paths:
+                digest = copy_engine.copy_file(
+                    source_path, target_path, progress.add, cancelled,
+                    checksum=self.journal is not None)
+                if self.journal is not None:
+                    self.journal.add(source_path, target_path, digest)
+
+        for source_path, target_path in paths:
+            self.logger.info('File copied: {}'.format(target_path))
+
+    def copy_unique(self, paths, target_dir):
+        # copies only the first source of every content and returns the
+        # directory the node should point to
+        copies = []
+        keys = []
+        duplicates = []
+        for source_path, target_path in paths:
+            key, first_target = self.dedupe.claim(source_path, target_path)
+            if first_target is None:
+                copies.append((source_path, target_path))
+                keys.append(key)
+            else:
+                duplicates.append((source_path, target_path, key, first_target))
+
+        try:
+            if copies:
+                self.copy(copies)
+        finally:
+            for key in keys:
+                self.dedupe.release(key)
+
+        # duplicates are resolved after the own claims are released, so
+        # runnables never wait on each other
+        links = []
+        for source_path, target_path, key, first_target in duplicates:
+            self.dedupe.wait(key)
+            if not self.running:
+                raise copy_engine.CopyCancelled
+            if not os.path.isfile(first_target):
+                # the first copy failed
+                self.copy([(source_path, target_path)])
+            elif first_target != target_path:
+                links.append((target_path, first_target))
+
+        directories = set(os.path.dirname(first_target) for target_path, first_target in links)
+        if (self.kwargs['dedupe'] == 'repoint' and not copies and len(links) == len(paths) and
+                len(directories) == 1 and
+                all(os.path.basename(t) == os.path.basename(f) for t, f in links)):
+            target_dir = directories.pop()
+            self.logger.info('Duplicate files, node repointed to: {}'.format(target_dir))
+            return target_dir
+
+        for target_path, first_target in links:
+            self.logger.info('Duplicate file linked: {} -> {}'.format(target_path, first_target))
+            copy_engine.link_file(first_target, target_path)
+        return target_dir
+
     def display_text(self):
         return self.node.filepath
 
+    @classmethod
+    def prepare(cls, nodes, values):
+        # sets up a run with the values of the relocate dialog, returns the
+        # number of threads to process the nodes with
+        cls.kwargs = values
+        cls.engine = None
+        cls.dedupe = None
+        cls.journal = None
+
+        # moves to other devices are journaled as well
+        cache_dir = utils.Settings().settings_path
+        cls.journal = copy_engine.Journal.from_target(values['path'], cache_dir)
+        if not values['resume']:
+            cls.journal.clear()
+
+        if not values['copy']:
+            # limit threads to preserve file io
+            return 2
+
+        # copies are limited by the engine
+        cls.engine = copy_engine.CopyEngine()
+        if values['dedupe'] != 'off':
+            paths = [path for node in nodes for path in node.file_sequence]
+            cls.dedupe = copy_engine.Deduplicator(paths)
+        return cls.engine.threads
+
     @staticmethod
     def reset():
-        RelocateRunnable.moved = []
+        RelocateRunnable.in_flight = processing.InFlightRegistry()
+
+
+class MaketxScheduler(object):
+    """Limits the maketx processes that run at the same time.
+
+    The cores budget is split into processes that run with a fixed number of
+    threads each, so that the conversions do not oversubscribe the machine.
+    """
+
+    def __init__(self, cores=0, threads=4):
+        cores = cores or QtCore.QThread.idealThreadCount()
+        self.threads = max(1, min(threads, cores))
+        self.processes = max(1, cores // self.threads)
+        self.semaphore = threading.Semaphore(self.processes)
+
+    @classmethod
+    def from_settings(cls):
+        settings = utils.Settings()
+        return cls(settings.int('maketx_cores'), settings.int('maketx_threads', 4))
 
 
 class TiledRunnable(processing.ProcessingRunnable):
-    processing = []
+    snapshot_attributes = ['filepath', 'filename', 'directory', 'is_file_sequence', 'file_sequence']
+    in_flight = processing.InFlightRegistry()
+    scheduler = None
+    cache = None
+
+    # arguments that affect the converted file, part of the cache key
+    maketx_options = ['--oiio', '--checknan', '--filter', 'lanczos3']
 
     def process(self):
         settings = utils.Settings()
@@ -338,35 +603,22 @@ class TiledRunnable(processing.ProcessingRunnable):
                 self.logger.info('Skipping... File already exists.')
                 continue
 
-            # is the file being process by another runnable?
-            if input_path in TiledRunnable.processing:
-                self.logger.info('Skipping... File already being processed by a different thread.')
+            # is the file being processed by another runnable?
+            owner = self.in_flight.acquire(input_path, lambda: self.running)
+            if owner is None:
+                return
+            if not owner:
+                self.logger.info('Skipping... File processed by a different thread.')
                 continue
-            TiledRunnable.processing.append(input_path)
-
-            if not os.path.isdir(output_dir):
-                os.makedirs(output_dir)
-
-            # the command line arguments
-            command_args = [
-                maketx_path,
-                '-v',
-                '--oiio',
-                '--checknan',
-                '--filter',  'lanczos3',
-                input_path,
-                '-o',  output_path
-                ]
-
-            command = ' '.join(command_args)
-            # py 2.7
-            command = str(command)
 
-            self.logger.info(command)
+            success = False
+            try:
+                if not self.convert(maketx_path, input_path, output_path):
+                    return
+                success = True
+            finally:
+                self.in_flight.release(input_path, success)
 
-            if self.popen(command_args):
-                # any return code other than None means there was an error.
-                raise Exception('The external command returned an error code.')
         name, ext = os.path.splitext(self.node.filename)
         outout_filename = '{}.tx'.format(name)
 
@@ -375,12 +627,79 @@ class TiledRunnable(processing.ProcessingRunnable):
 
         return True
 
+    def convert(self, maketx_path, input_path, output_path):
+        # returns True once output_path is written, None if stopped
+        output_dir = os.path.dirname(output_path)
+        if not os.path.isdir(output_dir):
+            try:
+                os.makedirs(output_dir)
+            except OSError:
+                # created by another thread
+                if not os.path.isdir(output_dir):
+                    raise
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(input_path, self.maketx_options)
+            if self.cache.fetch(cache_key, output_path):
+                self.logger.info('File taken from tx cache: {}'.format(output_path))
+                return True
+
+        # the command line arguments
+        command_args = [maketx_path, '-v']
+        if self.scheduler is not None:
+            command_args.extend(['--threads', str(self.scheduler.threads)])
+        command_args.extend(self.maketx_options)
+        command_args.extend([input_path, '-o', output_path])
+
+        command = ' '.join(command_args)
+        # py 2.7
+        command = str(command)
+
+        self.logger.info(command)
+
+        if self.scheduler is not None:
+            with self.scheduler.semaphore:
+                if not self.running:
+                    return
+                return_code = self.popen(command_args)
+        else:
+            return_code = self.popen(command_args)
+
+        if not self.running:
+            return
+
+        if return_code:
+            # any return code other than None means there was an error.
+            raise Exception('The external command returned an error code.')
+
+        if cache_key is not None:
+            self.cache.store(cache_key, output_path)
+        return True
+
     def display_text(self):
         return self.node.filepath
 
+    @staticmethod
+    def order(processing_items):
+        # largest inputs first, so that the longest conversions do not start last
+        sizes = {}
+        for processing_item in processing_items:
+            sizes[processing_item] = utils.FileSize.from_files(processing_item.node.file_sequence)
+        return sorted(processing_items, key=lambda i: sizes[i], reverse=True)
+
+    @classmethod
+    def prepare(cls, nodes):
+        # sets up a run from the settings, returns the number of threads to
+        # process the nodes with
+        cls.scheduler = MaketxScheduler.from_settings()
+        cls.cache = tx_cache.TxCache.from_settings()
+        cls.timeout = utils.Settings().int('maketx_timeout') or None
+        return cls.scheduler.processes
+
     @staticmethod
     def reset():
-        TiledRunnable.processing = []
+        TiledRunnable.in_flight = processing.InFlightRegistry()
 
 
 def open_file(nodes):
@@ -405,8 +724,7 @@ def set_directory(nodes):
 
     if not values:
         return
-    for node in nodes:
-        node.directory = values['path']
+    set_attributes([(node, 'directory', values['path']) for node in nodes])
 
 
 def find_and_replace(nodes):
@@ -427,9 +745,13 @@ def find_and_replace(nodes):
 
     regex = re.compile(pattern, flags)
 
+    edits = []
     for node in nodes:
-        filepath = regex.sub(values['replace'], node.filepath)
-        node.filepath = filepath
+        filepath = node.filepath
+        replaced = regex.sub(values['replace'], filepath)
+        if replaced != filepath:
+            edits.append((node, 'filepath', replaced))
+    set_attributes(edits)
 
 
 def relocate(nodes):
@@ -440,10 +762,8 @@ def relocate(nodes):
         return
 
     runnable = RelocateRunnable
-    runnable.kwargs = values
-
-    # limit threads to preserve file io
-    processing.ProcessingDialog.process(nodes, runnable, threads=2)
+    threads = runnable.prepare(nodes, values)
+    processing.ProcessingDialog.process(nodes, runnable, threads=threads)
 
 
 def locate(nodes):
@@ -455,6 +775,8 @@ def locate(nodes):
 
     runnable = LocateRunnable
     runnable.kwargs = values
+    # resolve all nodes with a single pass over the search root
+    runnable.batch = LocateBatch(nodes)
 
     # limit threads to preserve file io
     processing.ProcessingDialog.process(nodes, runnable, threads=2)
@@ -462,11 +784,13 @@ def locate(nodes):
 
 def generate_tiled(nodes):
     runnable_cls = TiledRunnable
-    processing.ProcessingDialog.process(nodes, runnable_cls)
+    threads = runnable_cls.prepare(nodes)
+    processing.ProcessingDialog.process(nodes, runnable_cls, threads=threads)
 
 
 def switch_raw(nodes):
     extensions = ['jpg', 'png', 'tif', 'tiff', 'exr', 'psd']
+    edits = []
     for node in nodes:
         raw_dir = re.sub(r'([\\\/])tiled([\\\/]|$)', r'\g<1>raw\g<2>', node.directory)
 
@@ -474,20 +798,22 @@ def switch_raw(nodes):
         for extension in extensions:
             file_pattern = re.sub(r'\.[^.]+$', '.{}'.format(extension), pattern)
 
-            for filename in os.listdir(raw_dir):
+            for filename in node.directory_cache.listdir(raw_dir):
                 if re.match(file_pattern, filename):
                     base, ext = os.path.splitext(node.filename)
                     raw_filename = '{}.{}'.format(base, extension)
-                    node.filename = raw_filename
-                    node.directory = raw_dir
+                    edits.append((node, 'filename', raw_filename))
+                    edits.append((node, 'directory', raw_dir))
                     break
             else:
                 continue
 
             break
+    set_attributes(edits)
 
 
 def switch_tiled(nodes):
+    edits = []
     for node in nodes:
         tiled_dir = re.sub(r'([\\\/])raw([\\\/]|$)', r'\g<1>tiled\g<2>', node.directory)
 
@@ -499,8 +825,9 @@ def switch_tiled(nodes):
 
         file_pattern = '{}.tx'.format(base)
 
-        for filename in os.listdir(tiled_dir):
+        for filename in node.directory_cache.listdir(tiled_dir):
             if re.match(file_pattern, filename):
-                node.filename = tiled_filename
-                node.directory = tiled_dir
+                edits.append((node, 'filename', tiled_filename))
+                edits.append((node, 'directory', tiled_dir))
                 break
+    set_attributes(edits)
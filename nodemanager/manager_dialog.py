@@ -7,6 +7,7 @@ from . import plugin_utils
 from . import utils
 from . import setup
 from . import manager_widget
+from . import tx_cache
 
 
 class ManagerDialog(QtWidgets.QDialog):
@@ -42,6 +43,9 @@ class ManagerDialog(QtWidgets.QDialog):
 
         action = menu.addAction('Reset Settings')
         action.triggered.connect(self.reset_settings)
+
+        action = menu.addAction('Clear Tx Cache')
+        action.triggered.connect(self.clear_tx_cache)
         menu_bar.addMenu(menu)
 
         menu = QtWidgets.QMenu('Help')
@@ -116,6 +120,29 @@ class ManagerDialog(QtWidgets.QDialog):
         if result == QtWidgets.QMessageBox.Yes:
             self.settings.clear()
 
+    def clear_tx_cache(self):
+        cache = tx_cache.TxCache.from_settings()
+        if cache is None:
+            QtWidgets.QMessageBox.information(
+                self,
+                'Clear Tx Cache',
+                'No tx cache path is set in the settings.',
+                QtWidgets.QMessageBox.Ok)
+            return
+
+        result = QtWidgets.QMessageBox.question(
+            self,
+            'Clear Tx Cache',
+            'Are you sure you want to remove all files from the tx cache?\n{}'.format(cache.path),
+            QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
+        if result == QtWidgets.QMessageBox.Yes:
+            removed, size = cache.evict(0)
+            QtWidgets.QMessageBox.information(
+                self,
+                'Clear Tx Cache',
+                'Removed {} files ({}).'.format(removed, utils.FileSize(size)),
+                QtWidgets.QMessageBox.Ok)
+
     def open_scripts_dir(self):
         os.startfile(os.path.dirname(__file__))
 
@@ -13,6 +13,7 @@ from . import gui_utils
 from . import utils
 from . import manager
 from . import attribute_table
+from . import filter_expression
 
 
 # py 2.7
@@ -106,11 +107,12 @@ class ManagerWidget(QtWidgets.QWidget):
         self.visible_chk.setEnabled(False)
 
     def connect_ui(self):
-        self.load_btn.clicked.connect(self.load)
+        self.load_btn.clicked.connect(lambda: self.load())
         self.model.update_requested.connect(self.attribute_view.update_requested)
         self.model.updated.connect(self.attribute_view.update)
         self.model.updated.connect(self.display_widget.update)
         self.display_widget.filter_changed.connect(self.sort_model.update_filters)
+        self.display_widget.expression_changed.connect(self.sort_model.update_expression)
 
     def closeEvent(self, event):
         self.save_settings()
@@ -162,7 +164,9 @@ class ManagerWidget(QtWidgets.QWidget):
         self.attribute_view.header_state = headers
         self.settings.endGroup()
 
-    def load(self):
+    def load(self, keep_values=False):
+        # rows are merged with the loaded nodes to keep selection and scroll
+        # position, keep_values also keeps the cached values of existing rows.
         self.status_bar.showMessage('Loading nodes...')
 
         options = {
@@ -172,7 +176,7 @@ class ManagerWidget(QtWidgets.QWidget):
         attribute_items = []
         try:
             attribute_items = self.manager.nodes(options=options)
-            self.model.set_items(attribute_items)
+            self.model.merge_items(attribute_items, keep_values)
         except RuntimeError as exception:
             message_box = QtWidgets.QMessageBox(
                 QtWidgets.QMessageBox.Warning,
@@ -237,7 +241,8 @@ class ActionWidget(QtWidgets.QWidget):
         if update == manager.Action.UPDATE_MODEL:
             self.attribute_view._model.update_items(attribute_items)
         elif update == manager.Action.RELOAD_MODEL:
-            self.manager_widget.load()
+            self.manager_widget.load(keep_values=True)
+            self.attribute_view._model.update_items(attribute_items)
 
 
 class IntEdit(QtWidgets.QLineEdit):
@@ -246,10 +251,13 @@ class IntEdit(QtWidgets.QLineEdit):
 
 class DisplayWidget(QtWidgets.QWidget):
     filter_changed = QtCore.Signal(dict)
+    expression_changed = QtCore.Signal(str)
 
     def __init__(self, table_view, parent=None):
         super(DisplayWidget, self).__init__(parent)
         self.table_view = table_view
+        self.attributes = []
+        self.expression = ''
         self.init_ui()
 
     def init_ui(self):
@@ -281,6 +289,17 @@ class DisplayWidget(QtWidgets.QWidget):
         if not node:
             return
 
+        self.attributes = node.attributes
+
+        # expression filter
+        widget = QtWidgets.QLineEdit(self)
+        widget.setPlaceholderText('file_size > 50MB and status == NOT_FOUND')
+        widget.setText(self.expression)
+        widget.textChanged.connect(self.expression_input_changed)
+        self.filter_lay.addRow('Expression', widget)
+        self.expression_input_changed(self.expression, widget)
+        self.filter_grp.setVisible(True)
+
         for attribute in node.attributes:
             try:
                 value = getattr(node, str(attribute))
@@ -343,6 +362,21 @@ class DisplayWidget(QtWidgets.QWidget):
 
         self.filter_changed.emit(filters)
 
+    def expression_input_changed(self, text, widget=None):
+        widget = widget or self.sender()
+        self.expression = text
+
+        error = ''
+        if text:
+            try:
+                filter_expression.parse(text, self.attributes)
+            except filter_expression.ExpressionError as e:
+                error = str(e)
+
+        widget.setToolTip(error)
+        widget.setStyleSheet('QLineEdit {color: red;}' if error else '')
+        self.expression_changed.emit(text)
+
 
 class VerticalScrollArea(QtWidgets.QScrollArea):
     def eventFilter(self, watched, event):
@@ -38,15 +38,27 @@ RELOAD_MODEL = manager.Action.RELOAD_MODEL
 
 class Node(manager.Node):
     # _name = None
+    _snapshot = None
+    _node_type = None
+    _graph = None
 
     def __getattr__(self, name):
         return self._get_node_attr(name)
 
     def __setattr__(self, name, value):
-        if name not in dir(self):
-            self._set_node_attr(name, value)
-        else:
+        if name in self.__dict__ or name in self._python_names():
             object.__setattr__(self, name, value)
+        else:
+            self._set_node_attr(name, value)
+
+    @classmethod
+    def _python_names(cls):
+        # names of the class and its bases, collected once per class
+        names = cls.__dict__.get('_class_names')
+        if names is None:
+            names = frozenset(dir(cls))
+            cls._class_names = names
+        return names
 
     def _attr(self, name):
         return '{}.{}'.format(self.node, name)
@@ -54,35 +66,70 @@ class Node(manager.Node):
     def _has_node_attr(self, name):
         return cmds.attributeQuery(name, node=self.node, exists=True)
 
+    def _get_node_type(self):
+        snapshot = self._snapshot
+        if snapshot is not None and self.node in snapshot:
+            return snapshot.node_type(self.node)
+        if self._node_type is None:
+            self._node_type = cmds.nodeType(self.node)
+        return self._node_type
+
+    def _shading_graph(self):
+        snapshot = self._snapshot
+        if snapshot is not None and self.node in snapshot:
+            return snapshot.shading_graph
+        # nodes outside of a load keep their own graph until invalidated
+        if self._graph is None:
+            self._graph = ShadingGraph()
+        return self._graph
+
     def _get_node_attr(self, name):
-        attr = self._attr(name)
-        try:
-            attr_type = cmds.getAttr(attr, type=True)
-            value = cmds.getAttr(attr)
-        except ValueError:
-            raise AttributeError('No attribute matches name: {}'.format(attr))
+        snapshot = self._snapshot
+        if snapshot is not None and self.node in snapshot:
+            attr_type, value = snapshot.get(self.node, name)
+        else:
+            attr = self._attr(name)
+            try:
+                attr_type = attribute_type(self.node, self._get_node_type(), name)
+                value = cmds.getAttr(attr)
+            except ValueError:
+                raise AttributeError('No attribute matches name: {}'.format(attr))
+        return self._convert_value(name, attr_type, value)
 
+    def _convert_value(self, name, attr_type, value):
         if attr_type == 'float3':
             value = QtGui.QColor.fromRgbF(*value[0])
         elif attr_type == 'double3':
             value = list(*value[0])
         elif attr_type == 'enum':
-            enum_strings = cmds.attributeQuery(name, node=self.node, listEnum=True)
-            names = enum_strings[0].split(':')
-            # sometimes enum_strings returns ['Sharp edges and corners=1:Sharp edges']
-            # add support for alt index
-
-            start = 0
-            if names and '=' in names[0]:
-                names[0], start = names[0].split('=')
-                start = int(start)
-
-            class_ = Enum(name.title(), names, start=start)
+            class_ = enum_class(self.node, self._get_node_type(), name)
             value = class_(value)
         return value
 
+    @classmethod
+    def attach(cls, nodes):
+        AttributeSnapshot.attach(nodes)
+
+    def invalidate(self):
+        # maya can change other attributes as a side effect, drop the whole node
+        self._graph = None
+        if self._snapshot is not None:
+            self._snapshot.invalidate(self.node)
+
+    @classmethod
+    def set_attributes(cls, edits):
+        # one undo chunk for all edits and no viewport refresh in between
+        cmds.undoInfo(openChunk=True, chunkName='nodemanager_set_attributes')
+        cmds.refresh(suspend=True)
+        try:
+            return super(Node, cls).set_attributes(edits)
+        finally:
+            cmds.refresh(suspend=False)
+            cmds.undoInfo(closeChunk=True)
+
     def _set_node_attr(self, name, value):
         attr = self._attr(name)
+        self.invalidate()
         try:
             # py 2.7
             if isinstance(value, str) or isinstance(value, unicode):
@@ -107,7 +154,10 @@ class Node(manager.Node):
 
     @name.setter
     def name(self, value):
-        self.node = cmds.rename(self.node, value)
+        node = cmds.rename(self.node, value)
+        if self._snapshot is not None:
+            self._snapshot.rename(self.node, node)
+        self.node = node
         # self._name = value
 
     @property
@@ -150,10 +200,247 @@ class Manager(manager.Manager):
             maya_nodes = cmds.ls(type=node_type)
 
         nodes = [node_cls(maya_node) for maya_node in maya_nodes]
+        AttributeSnapshot.attach(nodes)
 
         return nodes
 
 
+# {(node_type, attribute): attr_type}
+_attribute_types = {}
+# {(node_type, attribute): Enum}
+_enum_classes = {}
+
+
+def attribute_type(node, node_type, name):
+    # types are cached per node type, missing attributes are not cached as
+    # dynamic attributes can exist on some nodes of a type only
+    key = (node_type, name)
+    attr_type = _attribute_types.get(key)
+    if attr_type is None:
+        attr_type = cmds.getAttr('{}.{}'.format(node, name), type=True)
+        _attribute_types[key] = attr_type
+    return attr_type
+
+
+def enum_class(node, node_type, name):
+    # one class per node type and attribute, so values of all nodes compare equal
+    key = (node_type, name)
+    class_ = _enum_classes.get(key)
+    if class_ is None:
+        enum_strings = cmds.attributeQuery(name, node=node, listEnum=True)
+        names = enum_strings[0].split(':')
+        # sometimes enum_strings returns ['Sharp edges and corners=1:Sharp edges']
+        # add support for alt index
+
+        start = 0
+        if names and '=' in names[0]:
+            names[0], start = names[0].split('=')
+            start = int(start)
+
+        class_ = Enum(name.title(), names, start=start)
+        _enum_classes[key] = class_
+    return class_
+
+
+class AttributeSnapshot(object):
+    """Attribute values of all nodes of a load, read in bulk.
+
+    The first read of an attribute fetches it for every node of the snapshot
+    in one pass. Attribute types are queried once per node type, so each
+    value costs a single getAttr. Values are served from the snapshot until
+    they are invalidated, for example by setting the attribute.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = set(nodes)
+
+        # {node: node_type}
+        self.node_types = {}
+        # {node: set(attribute)} of attributes that do not exist, per node as
+        # dynamic attributes can exist on some nodes of a type only
+        self.missing = {}
+        # {attribute: {node: value}}
+        self.values = {}
+        self._shading_graph = None
+
+        self.update_node_types()
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    @classmethod
+    def attach(cls, nodes):
+        snapshot = cls([node.node for node in nodes])
+        for node in nodes:
+            node._snapshot = snapshot
+        return snapshot
+
+    def update_node_types(self):
+        if not self.nodes:
+            return
+        # ls returns long names only when asked for them
+        long = all(node.startswith('|') for node in self.nodes)
+        result = cmds.ls(list(self.nodes), showType=True, long=long) or []
+        self.node_types = dict(zip(result[::2], result[1::2]))
+
+    def node_type(self, node):
+        node_type = self.node_types.get(node)
+        if node_type is None:
+            node_type = cmds.nodeType(node)
+            self.node_types[node] = node_type
+        return node_type
+
+    def attr_type(self, node, name):
+        if name in self.missing.get(node, ()):
+            return None
+        try:
+            return attribute_type(node, self.node_type(node), name)
+        except (ValueError, RuntimeError):
+            self.missing.setdefault(node, set()).add(name)
+            return None
+
+    def rename(self, node, new_node):
+        # keeps a renamed node in the snapshot
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self.nodes.add(new_node)
+        if node in self.node_types:
+            self.node_types[new_node] = self.node_types.pop(node)
+        if node in self.missing:
+            self.missing[new_node] = self.missing.pop(node)
+        for values in self.values.values():
+            if node in values:
+                values[new_node] = values.pop(node)
+        # the graph refers to the old name and is built again on first use
+        self._shading_graph = None
+
+    def fetch(self, name):
+        values = {}
+        for node in self.nodes:
+            if self.attr_type(node, name) is None:
+                continue
+            try:
+                values[node] = cmds.getAttr('{}.{}'.format(node, name))
+            except (ValueError, RuntimeError):
+                continue
+        self.values[name] = values
+        return values
+
+    def get(self, node, name):
+        values = self.values.get(name)
+        if values is None:
+            values = self.fetch(name)
+
+        attr_type = self.attr_type(node, name)
+        if node not in values:
+            if attr_type is None:
+                raise AttributeError('No attribute matches name: {}.{}'.format(node, name))
+            # invalidated value
+            try:
+                values[node] = cmds.getAttr('{}.{}'.format(node, name))
+            except ValueError:
+                raise AttributeError('No attribute matches name: {}.{}'.format(node, name))
+        return attr_type, values[node]
+
+    @property
+    def shading_graph(self):
+        # built on first use and shared by all nodes of the load
+        if self._shading_graph is None:
+            self._shading_graph = ShadingGraph()
+        return self._shading_graph
+
+    def invalidate(self, node=None, name=None):
+        if node is None:
+            self.values = {}
+            self._shading_graph = None
+        elif name is None:
+            for values in self.values.values():
+                values.pop(node, None)
+            # attributes without values are fetched in bulk again
+            self.values = {key: values for key, values in self.values.items() if values}
+        else:
+            self.values.get(name, {}).pop(node, None)
+
+
+class ShadingGraph(object):
+    """Incoming connections of the shading networks in the scene.
+
+    Starting at all shaders, the connections are listed level by level with
+    a single listConnections call per level. The channels of all nodes are
+    then resolved with one traversal of the graph.
+    """
+
+    def __init__(self):
+        # {node: set(source_node)}
+        self.sources = {}
+        # {shader: [(attribute, source_node), ...]}
+        self.inputs = collections.OrderedDict()
+        self._channels = None
+
+        self.build()
+
+    def build(self):
+        shader_types = cmds.listNodeTypes('shader')
+        if not shader_types:
+            return
+        shaders = set(cmds.ls(type=shader_types) or [])
+
+        visited = set(shaders)
+        level = list(visited)
+        while level:
+            connections = cmds.listConnections(
+                level,
+                connections=True,
+                plugs=True,
+                source=True,
+                destination=False) or []
+
+            level = []
+            for i in range(0, len(connections), 2):
+                destination = connections[i]
+                source = connections[i + 1]
+
+                node = destination.split('.')[0]
+                source_node = source.split('.')[0]
+                self.sources.setdefault(node, set()).add(source_node)
+                if node in shaders:
+                    channel = destination.split('.')[-1]
+                    self.inputs.setdefault(node, []).append((channel, source_node))
+
+                if source_node not in visited:
+                    visited.add(source_node)
+                    level.append(source_node)
+
+    def upstream(self, node):
+        # node and all nodes in its history
+        nodes = set([node])
+        stack = [node]
+        while stack:
+            for source_node in self.sources.get(stack.pop(), ()):
+                if source_node not in nodes:
+                    nodes.add(source_node)
+                    stack.append(source_node)
+        return nodes
+
+    def resolve(self):
+        channels = {}
+        upstream = {}
+        for shader, inputs in self.inputs.items():
+            for channel, source_node in inputs:
+                if source_node not in upstream:
+                    upstream[source_node] = self.upstream(source_node)
+                for node in upstream[source_node]:
+                    channels.setdefault(node, []).append(channel)
+        return channels
+
+    def channels(self, node):
+        # shader attributes that node is connected to
+        if self._channels is None:
+            self._channels = self.resolve()
+        return list(self._channels.get(node, []))
+
+
 class Installer(setup.Installer):
     def create_button(self):
         shelf_name = 'Plugins'
@@ -214,38 +501,43 @@ class LocateRunnable(manager.LocateRunnable):
     def __init__(self, item):
         super(LocateRunnable, self).__init__(item)
 
-        self.node = ProcessingNode(self.node)
+        self.node = ProcessingNode(self.node, self.snapshot_attributes, self.write_back)
 
 
 class RelocateRunnable(manager.RelocateRunnable):
     def __init__(self, item):
         super(RelocateRunnable, self).__init__(item)
 
-        self.node = ProcessingNode(self.node)
+        self.node = ProcessingNode(self.node, self.snapshot_attributes, self.write_back)
 
 
 class TiledRunnable(manager.TiledRunnable):
     def __init__(self, item):
         super(TiledRunnable, self).__init__(item)
 
-        self.node = ProcessingNode(self.node)
+        self.node = ProcessingNode(self.node, self.snapshot_attributes, self.write_back)
 
 
 class ProcessingNode(object):
-    def __init__(self, node):
+    def __init__(self, node, attributes=None, write_back=None):
         self._node = node
-
-        # freeze attributes to be used in thread
-        for attr in dir(self._node):
-            if not attr.startswith('_'):
-                value = getattr(self._node, attr)
-                if isinstance(value, collections.Iterator):
-                    value = list(value)
-                object.__setattr__(self, attr, value)
+        self._write_back = write_back
+
+        # freeze attributes to be used in thread, values of maya attributes
+        # are read in bulk through the snapshot of the load
+        if attributes is None:
+            attributes = [attr for attr in dir(self._node) if not attr.startswith('_')]
+        for attr in attributes:
+            value = getattr(self._node, attr)
+            if isinstance(value, collections.Iterator):
+                value = list(value)
+            object.__setattr__(self, attr, value)
 
     def __setattr__(self, name, value):
-        if name == '_node':
+        if name in ('_node', '_write_back'):
             object.__setattr__(self, name, value)
+        elif self._write_back is not None:
+            self._write_back.push(self._node, name, value)
         else:
             maya_utils.executeDeferred(lambda: setattr(self._node, name, value))
 
@@ -268,9 +560,38 @@ def select(nodes):
     cmds.select(maya_nodes, replace=True)
 
 
+def select_dependents(nodes):
+    # one history query for all nodes and one set query per shading engine
+    maya_nodes = [node.node for node in nodes]
+    future = cmds.listHistory(maya_nodes, future=True) or []
+    shading_engines = set(cmds.ls(future, type='shadingEngine') or [])
+
+    objects = set()
+    for shading_engine in shading_engines:
+        objects.update(cmds.sets(shading_engine, query=True) or [])
+
+    if not objects:
+        return cmds.select(clear=True)
+    return cmds.select(list(objects), replace=True)
+
+
+def process(nodes, runnable_cls, threads=0):
+    # results of the workers are written back in batches while the dialog is
+    # open, the rest once it is closed and before the model updates
+    write_back = processing.WriteBackQueue(manager.set_attributes)
+    runnable_cls.write_back = write_back
+    write_back.start()
+    try:
+        processing.ProcessingDialog.process(nodes, runnable_cls, threads)
+    finally:
+        write_back.stop()
+        runnable_cls.write_back = None
+
+
 def generate_tiled(nodes):
     runnable_cls = TiledRunnable
-    processing.ProcessingDialog.process(nodes, runnable_cls)
+    threads = runnable_cls.prepare(nodes)
+    process(nodes, runnable_cls, threads=threads)
 
 
 def relocate(nodes):
@@ -281,10 +602,8 @@ def relocate(nodes):
         return
 
     runnable = RelocateRunnable
-    runnable.kwargs = values
-
-    # limit threads to preserve file io
-    processing.ProcessingDialog.process(nodes, runnable, threads=2)
+    threads = runnable.prepare(nodes, values)
+    process(nodes, runnable, threads=threads)
 
 
 def locate(nodes):
@@ -296,6 +615,8 @@ def locate(nodes):
 
     runnable = LocateRunnable
     runnable.kwargs = values
+    # resolve all nodes with a single pass over the search root
+    runnable.batch = manager.LocateBatch(nodes)
 
     # limit threads to preserve file io
-    processing.ProcessingDialog.process(nodes, runnable, threads=2)
+    process(nodes, runnable, threads=2)
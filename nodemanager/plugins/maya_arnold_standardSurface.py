@@ -1,6 +1,5 @@
 from __future__ import absolute_import
 
-from maya import cmds
 from PySide2 import QtWidgets
 
 from . import maya
@@ -19,7 +18,7 @@ class Manager(maya.Manager):
         super(Manager, self).__init__(*args)
 
         # addAction(group, label, func, update=UPDATE_MODEL)
-        self.addAction('Node', 'Select Dependent Objects', select_dependents, IGNORE_UPDATE)
+        self.addAction('Node', 'Select Dependent Objects', maya.select_dependents, IGNORE_UPDATE)
 
         self.addFilter('name')
 
@@ -104,20 +103,3 @@ class Node(maya.Node):
             # 'aovId8',
             # 'id8'
             ])
-
-
-def select_dependents(nodes):
-    objects = []
-
-    for node in nodes:
-        future = cmds.listHistory(node.node, future=True)
-        shading_engines = cmds.ls(*future, type='shadingEngine')
-
-        for shading_engine in shading_engines:
-            set_members = cmds.sets(shading_engine, query=True)
-            objects.extend(set_members)
-
-    objects = list(set(objects))
-    selection = cmds.select(objects, replace=True)
-
-    return selection
@@ -31,7 +31,7 @@ class Manager(maya.Manager):
         self.addAction('Tiled', 'Switch to Raw', manager.switch_raw)
         self.addAction('Tiled', 'Switch to Tiled', manager.switch_tiled)
         self.addAction('Node', 'Convert', convert, RELOAD_MODEL)
-        self.addAction('Node', 'Select Dependent Objects', select_dependents, IGNORE_UPDATE)
+        self.addAction('Node', 'Select Dependent Objects', maya.select_dependents, IGNORE_UPDATE)
 
         self.addFilter('name')
         self.addFilter('status')
@@ -79,60 +79,25 @@ class Node(manager.FileNode, maya.Node):
 
     @property
     def channels(self):
-        channels = []
-
-        shader_types = cmds.listNodeTypes('shader')
-        future = cmds.listHistory(self.node, future=True)
-        descendents = cmds.ls(*future, type=shader_types)
-
-        for descendent in descendents:
-            in_connections = cmds.listConnections(
-                descendent,
-                connections=True,
-                source=True,
-                destination=False)
-            for i in range(0, len(in_connections), 2):
-                source = in_connections[i + 1]
-                destination = in_connections[i]
-
-                source_node = source.split('.')[0]
-                if not cmds.objExists(source_node):
-                    continue
-                history = cmds.listHistory(source_node)
-                if self.node in history:
-                    channels.append(destination.split('.')[-1])
-        return channels
-
-
-def select_dependents(nodes):
-    objects = []
-
-    for node in nodes:
-        future = cmds.listHistory(node.node, future=True)
-        shading_engines = cmds.ls(*future, type='shadingEngine')
-
-        for shading_engine in shading_engines:
-            set_members = cmds.sets(shading_engine, query=True)
-            objects.extend(set_members)
-
-    objects = list(set(objects))
-    selection = cmds.select(objects, replace=True)
-
-    return selection
+        return self._shading_graph().channels(self.node)
 
 
 def auto_filter(nodes):
+    edits = []
     for node in nodes:
-        node.filter = 0
-        node.mipmapBias = 0
+        edits.append((node, 'filter', 0))
+        edits.append((node, 'mipmapBias', 0))
+    manager.set_attributes(edits)
 
 
 def auto_colorspace(nodes):
+    edits = []
     for node in nodes:
         if any(['color' in channel.lower() for channel in node.channels]):
-            node.colorSpace = 'sRGB'
+            edits.append((node, 'colorSpace', 'sRGB'))
         else:
-            node.colorSpace = 'linear'
+            edits.append((node, 'colorSpace', 'linear'))
+    manager.set_attributes(edits)
 
 
 def convert(nodes):
@@ -33,20 +33,27 @@ class Manager(maya.Manager):
         # addAction(group, label, func, update=UPDATE_MODEL)
 
     def nodes(self, options={}, maya_cls=Node):
+        # query all meshes at once instead of the shapes of every transform
         if options.get('selection'):
             transforms = cmds.ls(selection=True, type='transform', long=True)
-            children = cmds.listRelatives(transforms, allDescendents=True, fullPath=True, type='transform') or []
-            transforms.extend(children)
+            meshes = []
+            if transforms:
+                meshes = cmds.listRelatives(transforms, allDescendents=True, fullPath=True, type='mesh') or []
+            if meshes:
+                meshes = cmds.ls(meshes, long=True, noIntermediate=True) or []
         else:
-            transforms = cmds.ls(type='transform', long=True)
+            meshes = cmds.ls(type='mesh', long=True, noIntermediate=True) or []
 
+        # keep the first mesh of every transform
         maya_nodes = []
-
-        for transform in transforms:
-            shapes = cmds.listRelatives(transform, shapes=True, fullPath=True)
-            if shapes and cmds.nodeType(shapes[0]) == 'mesh':
-                maya_nodes.append(shapes[0])
+        transforms = set()
+        for mesh in meshes:
+            transform = mesh.rsplit('|', 1)[0]
+            if transform not in transforms:
+                transforms.add(transform)
+                maya_nodes.append(mesh)
 
         nodes = [maya_cls(maya_node) for maya_node in maya_nodes]
+        maya.AttributeSnapshot.attach(nodes)
 
         return nodes
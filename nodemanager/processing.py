@@ -3,6 +3,9 @@ import os
 import sys
 import random
 import subprocess
+import threading
+import time
+from collections import deque
 from functools import partial
 from enum import Enum, unique
 from PySide2 import QtWidgets, QtGui, QtCore
@@ -102,10 +105,11 @@ class ProcessingDialog(QtWidgets.QDialog):
             processing_item.queued.connect(partial(self.item_queued, item))
             processing_item.started.connect(partial(self.item_started, item))
             processing_item.finished.connect(partial(self.item_finished, item))
+            processing_item.progress_changed.connect(partial(self.item_progress, item))
 
             processing_items.append(processing_item)
 
-        random.shuffle(processing_items)
+        processing_items = self.runnable_cls.order(processing_items)
         for processing_item in processing_items:
             processing_item.start()
 
@@ -132,6 +136,9 @@ class ProcessingDialog(QtWidgets.QDialog):
             self.finished()
         self.update_progress()
 
+    def item_progress(self, item, value):
+        self.update_item(item)
+
     def finished(self):
         self.status_bar.showMessage('Done', 1000)
         for row in range(self.model.rowCount()):
@@ -144,7 +151,10 @@ class ProcessingDialog(QtWidgets.QDialog):
     def update_item(self, item):
         item = self.model.item(item.row(), 0)
         processing_item = item.data()
-        item.setData(processing_item.state.value, QtCore.Qt.DisplayRole)
+        text = processing_item.state.value
+        if processing_item.state == ProcessingState.INPROGRESS and processing_item.progress is not None:
+            text = '{} {}%'.format(text, processing_item.progress)
+        item.setData(text, QtCore.Qt.DisplayRole)
         item.setData(self.icon(processing_item.state), QtCore.Qt.DecorationRole)
 
         item = self.model.item(item.row(), 1)
@@ -271,6 +281,14 @@ class ProcessingView(QtWidgets.QTableView):
 
 
 class ProcessingRunnable(QtCore.QRunnable):
+    # node attributes that process reads, dcc plugins capture only these for
+    # the thread. None captures all attributes.
+    snapshot_attributes = None
+    # WriteBackQueue for attribute writes that have to happen on the main thread
+    write_back = None
+    # seconds after which external commands are killed, None does not limit the time
+    timeout = None
+
     def __init__(self, item):
         super(ProcessingRunnable, self).__init__()
         self.item = item
@@ -278,7 +296,7 @@ class ProcessingRunnable(QtCore.QRunnable):
         self.logger = item.logger
         self.running = False
 
-        self._process = None
+        self._runner = None
 
     def run(self):
         self.running = True
@@ -302,35 +320,22 @@ class ProcessingRunnable(QtCore.QRunnable):
         if not self.running:
             self.item._cancelled()
         else:
-            if self._process:
-                self._process.kill()
+            if self._runner:
+                self._runner.kill()
             self.running = False
 
     def process(self):
         return True
         # example code
 
-    def popen(self, args, **kwargs):
-        startupinfo = None
-        if os.name == 'nt':
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    def popen(self, args, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
 
-        self._process = subprocess.Popen(
-            args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            startupinfo=startupinfo,
-            # py 2.7
-            # text=True,
-            universal_newlines=True
-        )
-
-        if self.logger.level == logging.DEBUG:
-            while self._process.poll() is None:
-                self.logger.info(self._process.stdout.readline(), extra={'raw': True})
-            self._process.stdout.close()
-        return_code = self._process.wait()
+        self._runner = ProcessRunner(args, self.logger, timeout)
+        if not self.running:
+            return
+        return_code = self._runner.run()
 
         if return_code:
             self.logger.error(subprocess.CalledProcessError(return_code, args))
@@ -340,12 +345,223 @@ class ProcessingRunnable(QtCore.QRunnable):
     def display_text(self):
         return self.node.name
 
+    @staticmethod
+    def order(processing_items):
+        # the order in which the items are queued
+        random.shuffle(processing_items)
+        return processing_items
+
     @staticmethod
     def reset():
         # reset the runnable class, clearing any class variables that are set during the processing
         pass
 
 
+class ProcessRunner(object):
+    """Runs an external command and streams its output to a logger.
+
+    A reader thread always drains stdout, so a verbose process never blocks
+    on a full pipe. The output is only logged in DEBUG mode, in batches of
+    lines every interval milliseconds. Otherwise only the last lines are
+    logged if the command fails. The process is killed after timeout
+    seconds or when kill is called from another thread.
+    """
+
+    def __init__(self, args, logger, timeout=None, interval=250, tail=20):
+        self.args = args
+        self.logger = logger
+        self.timeout = timeout
+        self.interval = interval
+        self.verbose = logger.level == logging.DEBUG
+
+        self.process = None
+        self.killed = False
+        self.timed_out = False
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+        self.lines = []
+        self.tail = deque(maxlen=tail)
+
+    def run(self):
+        startupinfo = None
+        if os.name == 'nt':
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+
+        with self.lock:
+            if self.killed:
+                return
+            self.process = subprocess.Popen(
+                self.args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                startupinfo=startupinfo,
+                # py 2.7
+                # text=True,
+                universal_newlines=True
+            )
+
+        reader = threading.Thread(target=self.read)
+        reader.daemon = True
+        reader.start()
+
+        deadline = None
+        if self.timeout:
+            deadline = time.time() + self.timeout
+
+        # flush the output until the pipe is closed
+        while not self.finished.wait(self.interval / 1000.0):
+            self.flush()
+            if deadline is not None and time.time() > deadline and not self.timed_out:
+                self.timed_out = True
+                self.logger.error('Process timed out after {} seconds.'.format(self.timeout))
+                self.kill()
+        reader.join()
+        self.flush()
+
+        return_code = self.process.wait()
+        if return_code and not self.verbose and self.tail:
+            self.logger.info(''.join(self.tail), extra={'raw': True})
+        return return_code
+
+    def read(self):
+        try:
+            for line in iter(self.process.stdout.readline, ''):
+                with self.lock:
+                    if self.verbose:
+                        self.lines.append(line)
+                    else:
+                        self.tail.append(line)
+            self.process.stdout.close()
+        finally:
+            self.finished.set()
+
+    def flush(self):
+        with self.lock:
+            lines = self.lines
+            self.lines = []
+        if lines:
+            self.logger.info(''.join(lines), extra={'raw': True})
+
+    def kill(self):
+        with self.lock:
+            self.killed = True
+            if self.process is None or self.process.poll() is not None:
+                return
+            try:
+                self.process.kill()
+            except OSError:
+                # the process exited in the meantime
+                pass
+
+
+class InFlightRegistry(object):
+    """Paths that runnables are working on, shared by all threads.
+
+    The first runnable that claims a path processes it. Other runnables that
+    need the same path wait until it is released instead of skipping it. A
+    path that failed is released for a new claim, so a waiting or restarted
+    runnable processes it again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # {path: Event}
+        self.events = {}
+        # {path: success}
+        self.results = {}
+
+    def claim(self, path):
+        # returns True if the caller owns path and has to release it
+        with self.lock:
+            if path in self.events:
+                return False
+            self.events[path] = threading.Event()
+            return True
+
+    def release(self, path, success=True):
+        with self.lock:
+            event = self.events[path]
+            if success:
+                self.results[path] = True
+            else:
+                del self.events[path]
+        event.set()
+
+    def wait(self, path, running=None):
+        """Waits until path is released and returns whether it succeeded.
+
+        running is called while waiting, the wait is aborted if it returns
+        False.
+        """
+
+        with self.lock:
+            event = self.events.get(path)
+        if event is None:
+            return False
+        while not event.wait(0.1):
+            if running is not None and not running():
+                return False
+        with self.lock:
+            return self.results.get(path, False)
+
+    def acquire(self, path, running=None):
+        """Claims path or waits for the runnable that owns it.
+
+        Returns True if the caller owns path and has to release it, False if
+        another runnable processed it and None if the wait was aborted.
+        """
+
+        while not self.claim(path):
+            if self.wait(path, running):
+                return False
+            if running is not None and not running():
+                return None
+            # the owner failed, try to claim the path again
+        return True
+
+
+class WriteBackQueue(QtCore.QObject):
+    """Attribute writes of worker threads, applied on the main thread.
+
+    Workers push (node, attribute, value) edits from any thread. A timer on
+    the main thread drains the queue and passes every batch to apply, so a
+    batch can be written as one bulk edit.
+    """
+
+    def __init__(self, apply, interval=250, parent=None):
+        super(WriteBackQueue, self).__init__(parent)
+        self.apply = apply
+        self.lock = threading.Lock()
+        self.edits = []
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+
+    def push(self, node, attribute, value):
+        with self.lock:
+            self.edits.append((node, attribute, value))
+
+    def flush(self):
+        with self.lock:
+            edits = self.edits
+            self.edits = []
+        if edits:
+            try:
+                self.apply(edits)
+            except Exception as e:
+                logging.critical(e, exc_info=True)
+
+    def start(self):
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.flush()
+
+
 @unique
 class ProcessingState(Enum):
     OPEN = 'Open'
@@ -373,6 +589,7 @@ class ProcessingItem(QtCore.QObject):
     queued = QtCore.Signal()
     started = QtCore.Signal()
     finished = QtCore.Signal()
+    progress_changed = QtCore.Signal(int)
 
     log_updated = QtCore.Signal(str)
 
@@ -382,6 +599,7 @@ class ProcessingItem(QtCore.QObject):
         self.runnable_cls = runnable_cls
         self.runnable = None
         self.state = ProcessingState.OPEN
+        self.progress = None
 
         self.runnable_cls.reset()
 
@@ -411,8 +629,14 @@ class ProcessingItem(QtCore.QObject):
         self.logger.critical(exception, exc_info=True)
         self.finished.emit()
 
+    def _progress(self, value):
+        # percent of the work done, for runnables that can report it
+        self.progress = value
+        self.progress_changed.emit(value)
+
     def start(self):
         self.state = ProcessingState.PENDING
+        self.progress = None
         self.runnable = self.runnable_cls(self)
         self.queued.emit()
 
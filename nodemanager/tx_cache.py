@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import os
+import threading
+
+from . import copy_engine
+from . import utils
+
+
+class TxCache(object):
+    """Converted .tx files keyed by the input content and the maketx arguments.
+
+    Conversions are looked up before maketx runs and stored once it finished,
+    so the same texture is only converted once across all projects. Cached
+    files are materialized by hard link or copy. Once the cache exceeds its
+    size, the least recently used files are evicted down to a lower mark, so
+    that not every store has to walk the cache.
+    """
+
+    # fraction of size that eviction frees the cache down to
+    low_mark = 0.9
+
+    def __init__(self, path, size=0):
+        self.path = path
+        # maximum size in bytes, 0 does not limit the size
+        self.size = size
+        self.lock = threading.Lock()
+
+        self.total = None
+
+    def __repr__(self):
+        return 'TxCache({})'.format(self.path)
+
+    @classmethod
+    def from_settings(cls):
+        # returns None if no cache path is set
+        settings = utils.Settings()
+        path = settings.value('tx_cache_path')
+        if not path:
+            return None
+        size = settings.int('tx_cache_size', 0) * utils.FileSize.factors['GB']
+        return cls(path, size)
+
+    def key(self, input_path, args):
+        sha1 = hashlib.sha1()
+        sha1.update(copy_engine.file_hash(input_path).encode('utf-8'))
+        sha1.update('\0'.join(args).encode('utf-8'))
+        return sha1.hexdigest()
+
+    def file_path(self, key):
+        return os.path.join(self.path, key[:2], '{}.tx'.format(key))
+
+    def fetch(self, key, output_path):
+        # materializes the cached file at output_path, returns False on a miss
+        path = self.file_path(key)
+        try:
+            # the mtime marks the last use
+            os.utime(path, None)
+            copy_engine.link_file(path, output_path)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def store(self, key, output_path):
+        path = self.file_path(key)
+        try:
+            dirpath = os.path.dirname(path)
+            if not os.path.isdir(dirpath):
+                try:
+                    os.makedirs(dirpath)
+                except OSError:
+                    if not os.path.isdir(dirpath):
+                        raise
+            copy_engine.copy_file(output_path, path)
+            size = os.path.getsize(path)
+        except (IOError, OSError) as e:
+            logging.warning('Could not store file in tx cache: {} ({})'.format(path, e))
+            return False
+
+        with self.lock:
+            if self.total is not None:
+                self.total += size
+        if self.size and self.used() > self.size:
+            self.evict(int(self.size * self.low_mark))
+        return True
+
+    def files(self):
+        # returns [(mtime, size, path), ...] of all cached files
+        files = []
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for filename in filenames:
+                if not filename.endswith('.tx'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def used(self):
+        with self.lock:
+            if self.total is None:
+                self.total = sum(size for mtime, size, path in self.files())
+            return self.total
+
+    def evict(self, size=None):
+        """Removes the least recently used files until the cache fits size.
+
+        Uses the size of the cache if size is None. Returns the number of
+        removed files and bytes.
+        """
+
+        if size is None:
+            size = self.size
+
+        with self.lock:
+            files = sorted(self.files())
+            total = sum(file_size for mtime, file_size, path in files)
+
+            removed = 0
+            removed_size = 0
+            for mtime, file_size, path in files:
+                if total <= size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= file_size
+                removed += 1
+                removed_size += file_size
+            self.total = total
+        return removed, removed_size
@@ -65,6 +65,8 @@ class RelocateDialog(QtWidgets.QDialog):
         values['copy'] = self.copy_radio.isChecked()
         values['ignore_update'] = self.ignore_update_chk.isChecked()
         values['parent'] = self.parent_chk.isChecked()
+        values['dedupe'] = ('off', 'hardlink', 'repoint')[self.dedupe_cmb.currentIndex()]
+        values['resume'] = self.resume_chk.isChecked()
         return values
 
     @classmethod
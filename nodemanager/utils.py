@@ -59,6 +59,16 @@ class FileSize(int):
             size = 0
         return cls(size)
 
+    @classmethod
+    def from_files(cls, filepaths):
+        size = 0
+        for filepath in filepaths:
+            try:
+                size += os.path.getsize(filepath)
+            except OSError:
+                continue
+        return cls(size)
+
 
 class Settings(QtCore.QSettings):
     def __init__(self):
@@ -77,6 +87,15 @@ class Settings(QtCore.QSettings):
         default_values = {
             'load_on_open': False,
             'maketx_path': r'C:\Program Files\Autodesk\Arnold\maya2022\bin\maketx.exe',
+            # cores used by all maketx processes together, 0 uses all cores
+            'maketx_cores': 0,
+            'maketx_threads': 4,
+            # seconds after which a maketx process is killed, 0 does not limit the time
+            'maketx_timeout': 0,
+            # shared cache of converted files, an empty path disables the cache
+            'tx_cache_path': '',
+            # size of the cache in GB, 0 does not limit the size
+            'tx_cache_size': 100,
         }
         for key, value in default_values.items():
             if key not in self.childKeys():
@@ -92,6 +111,12 @@ class Settings(QtCore.QSettings):
             else:
                 return bool(value)
 
+    def int(self, key, default=0):
+        try:
+            return int(self.value(key, default))
+        except (TypeError, ValueError):
+            return default
+
     def list(self, key):
         # default not always working
         value = self.value(key, []) or []